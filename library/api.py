@@ -0,0 +1,110 @@
+# library/api.py
+"""
+Helpers for the read-only JSON catalog API (see the api_* views).
+
+Every response carries a strong ETag and a Last-Modified date, so clients
+that send them back get a bodiless 304 while the catalog is unchanged. The
+validators are computed without reading any book rows: the list ETag comes
+from the catalog version plus max(updated_at) and count(*) over indexes,
+and a book's from its own updated_at.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .catalog_cache import acatalog_version, catalog_version
+from .models import Book
+
+# Columns loaded for, and returned by, every book in a payload
+BOOK_FIELDS = ('id', 'title', 'author', 'genre', 'status', 'rating_avg', 'rating_count', 'updated_at')
+
+JSON_PARAMS = {'separators': (',', ':')}
+
+
+def book_payload(book):
+    return {field: getattr(book, field) for field in BOOK_FIELDS}
+
+
+def page_payload(page):
+    return {
+        'results': [book_payload(book) for book in page],
+        'next': page.next_cursor,
+    }
+
+
+def _etag(*parts):
+    return hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _catalog_stamp(request):
+    # Both validators need it; ask the database once per request.
+    if not hasattr(request, '_catalog_stamp'):
+        request._catalog_stamp = Book.objects.aggregate(last=Max('updated_at'), count=Count('id'))
+    return request._catalog_stamp
+
+
+def catalog_etag(request, *args, **kwargs):
+    """ETag shared by every listing and search page.
+
+    max(updated_at) and count(*) catch edits and deletions made through
+    other processes, the catalog version anything that bumps it. The
+    version alone is not enough: with the default per-process cache a
+    delete in another worker never reaches this one, and a delete leaves
+    max(updated_at) alone. count(*) reads the smallest index, not the rows.
+    The page's own URL (filters, cursor) is what the client revalidates,
+    so it need not be part of the tag.
+    """
+    return _catalog_tag(catalog_version(), _catalog_stamp(request))
+
+
+def _catalog_tag(version, stamp):
+    return _etag(version, stamp['last'], stamp['count'])
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return _catalog_stamp(request)['last']
+
+
+async def acatalog_validators(request):
+    """(ETag, Last-Modified) of catalog_etag/catalog_last_modified, via the async ORM."""
+    stamp = await Book.objects.aaggregate(last=Max('updated_at'), count=Count('id'))
+    return _catalog_tag(await acatalog_version(), stamp), stamp['last']
+
+
+def conditional_response(request, etag, last_modified):
+    """A 304 response if the client's copy is current, otherwise None.
+
+    Django's condition() decorator calls its validators synchronously, so
+    async views await theirs and then come here.
+    """
+    return get_conditional_response(
+        request,
+        etag=quote_etag(etag),
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def set_validators(response, etag, last_modified):
+    response.headers.setdefault('ETag', quote_etag(etag))
+    if last_modified:
+        response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    return response
+
+
+def _book_updated_at(request, book_id):
+    if not hasattr(request, '_book_updated_at'):
+        request._book_updated_at = Book.objects.filter(pk=book_id).values_list('updated_at', flat=True).first()
+    return request._book_updated_at
+
+
+def book_etag(request, book_id, *args, **kwargs):
+    updated_at = _book_updated_at(request, book_id)
+    # No tag for a missing book, so the view runs and answers 404
+    return _etag(book_id, updated_at.isoformat()) if updated_at else None
+
+
+def book_last_modified(request, book_id, *args, **kwargs):
+    return _book_updated_at(request, book_id)
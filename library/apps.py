@@ -1,6 +1,22 @@
 from django.apps import AppConfig # type: ignore
+from django.db.backends.signals import connection_created # type: ignore
+from django.db.models.signals import post_migrate # type: ignore
 
 
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import install_query_timer
+
+        post_migrate.connect(restore_search_index, sender=self)
+        connection_created.connect(install_query_timer)
+
+
+def restore_search_index(using, **kwargs):
+    from django.db import connections
+    from .search import create_index
+
+    create_index(connections[using])
@@ -0,0 +1,68 @@
+# library/auth.py
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+# Every request of a logged-in user looks them up by id from the session.
+# The row (role, is_active, password hash for the session check, ...) is
+# cached under this key and dropped whenever it changes: saves and deletes
+# through library.signals, queryset updates through forget_user() calls.
+USER_KEY = 'library:user:{}'
+
+
+def _timeout():
+    return getattr(settings, 'LIBRARY_USER_CACHE_TIMEOUT', 300)
+
+
+def _record(user):
+    return user._state.db, {field.attname: getattr(user, field.attname) for field in user._meta.concrete_fields}
+
+
+def _from_record(record):
+    db, values = record
+    # from_db() builds a saved instance; fields missing from an older
+    # record come back deferred and load on first access.
+    return get_user_model().from_db(db, list(values), list(values.values()))
+
+
+def forget_user(*user_ids):
+    """Drop cached users now and again once the current transaction commits.
+
+    The first delete keeps this transaction from reading the old entry; the
+    second drops the old row if a concurrent request re-cached it before
+    the commit.
+    """
+    keys = [USER_KEY.format(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedUserBackend(ModelBackend):
+    """ModelBackend whose per-request user lookup is served from the cache.
+
+    Only active users are cached. Banning, a role change, deletion or a
+    password change invalidates the entry, so the next request reloads the
+    row and is logged out or re-authorized straight away. Across processes
+    that needs a shared cache (see CACHES).
+    """
+
+    def get_user(self, user_id):
+        record = cache.get(USER_KEY.format(user_id))
+        if record is not None:
+            return _from_record(record)
+        user = super().get_user(user_id)
+        if user is not None:
+            cache.set(USER_KEY.format(user_id), _record(user), _timeout())
+        return user
+
+    async def aget_user(self, user_id):
+        record = await cache.aget(USER_KEY.format(user_id))
+        if record is not None:
+            return _from_record(record)
+        user = await super().aget_user(user_id)
+        if user is not None:
+            await cache.aset(USER_KEY.format(user_id), _record(user), _timeout())
+        return user
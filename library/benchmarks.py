@@ -0,0 +1,574 @@
+# library/benchmarks.py
+"""
+Micro-benchmarks run with ``manage.py benchmark <name>``.
+
+Each benchmark takes the number of concurrent workers and operations per
+worker and returns one result dict per configuration it compares, so the
+command can print them side by side.
+"""
+
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from itertools import cycle
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+def _timed_workers(workers, target):
+    """Run ``target(worker_number)`` in ``workers`` threads started together; return wall time."""
+    barrier = threading.Barrier(workers + 1)
+
+    def run(number):
+        barrier.wait()
+        target(number)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+SQLITE_CONFIGS = {
+    'stock': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'OPTIONS': {},
+    },
+    'tuned': {
+        'ENGINE': 'library_management_system.sqlite_backend',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'lock_retries': 5},
+    },
+}
+
+
+def sqlite_writes(workers=8, operations=200):
+    """Concurrent borrow-shaped write transactions against a file database.
+
+    Every operation reads a counter, bumps it and appends a log row in one
+    transaction, like a checkout. Each configuration gets a fresh database
+    file; transactions that fail with a lock error are counted, not retried.
+    """
+    results = []
+    directory = tempfile.mkdtemp(prefix='library-bench-')
+    try:
+        for label, config in SQLITE_CONFIGS.items():
+            alias = f'bench_{label}'
+            connections.settings[alias] = {
+                **config,
+                'NAME': os.path.join(directory, f'{label}.sqlite3'),
+                'CONN_MAX_AGE': None,
+            }
+            connections.configure_settings(connections.settings)
+            with connections[alias].cursor() as cursor:
+                cursor.execute('CREATE TABLE bench_counter (id INTEGER PRIMARY KEY, n INTEGER NOT NULL)')
+                cursor.execute('CREATE TABLE bench_log (id INTEGER PRIMARY KEY, worker INTEGER, n INTEGER)')
+                cursor.execute('INSERT INTO bench_counter (id, n) VALUES (1, 0)')
+            connections[alias].close()
+
+            failures = []
+
+            def work(number):
+                try:
+                    for _ in range(operations):
+                        try:
+                            with transaction.atomic(using=alias):
+                                with connections[alias].cursor() as cursor:
+                                    cursor.execute('SELECT n FROM bench_counter WHERE id = 1')
+                                    n = cursor.fetchone()[0]
+                                    cursor.execute('UPDATE bench_counter SET n = n + 1 WHERE id = 1')
+                                    cursor.execute('INSERT INTO bench_log (worker, n) VALUES (%s, %s)', [number, n])
+                        except DatabaseError:
+                            failures.append(number)
+                finally:
+                    connections[alias].close()
+
+            elapsed = _timed_workers(workers, work)
+            committed = workers * operations - len(failures)
+            results.append({
+                'config': label,
+                'workers': workers,
+                'committed': committed,
+                'failed': len(failures),
+                'seconds': round(elapsed, 3),
+                'ops_per_sec': round(committed / elapsed, 1),
+            })
+            del connections[alias]
+            del connections.settings[alias]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+# Anonymous read-only requests: the HTML search page and the JSON search
+CATALOG_REQUESTS = [
+    ('/books/search/', 'search=dune'),
+    ('/api/books/search/', 'search=tolkien'),
+    ('/books/search/', 'sort=rating'),
+    ('/api/books/search/', 'search=poetry&page_size=50'),
+]
+BENCH_HOST = 'localhost'
+
+
+def _wsgi_get(handler, path, query):
+    environ = RequestFactory(SERVER_NAME=BENCH_HOST).get(path, QUERY_STRING=query).environ
+    status = []
+    body = handler(environ, lambda line, headers: status.append(int(line.split()[0])))
+    b''.join(body)
+    body.close()
+    return status[0]
+
+
+async def _asgi_get(handler, path, query):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', BENCH_HOST.encode())],
+        'client': ('127.0.0.1', 0), 'server': (BENCH_HOST, 80),
+    }
+    requested = False
+    status = []
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects; the handler cancels this wait
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+def wsgi_vs_asgi(workers=8, operations=200):
+    """Concurrent catalog searches through the WSGI and the ASGI handler.
+
+    WSGI is driven like a threaded server with ``workers`` threads, ASGI
+    like uvicorn with ``workers`` concurrent connections on one event loop,
+    each making ``operations`` requests through the full middleware stack
+    against the configured database (seed it first). Non-200 responses are
+    counted as failures.
+    """
+    results = []
+
+    handler = WSGIHandler()
+    failures = []
+
+    def work(number):
+        try:
+            requests = cycle(CATALOG_REQUESTS[number % len(CATALOG_REQUESTS):] + CATALOG_REQUESTS)
+            for _ in range(operations):
+                if _wsgi_get(handler, *next(requests)) != 200:
+                    failures.append(number)
+        finally:
+            connections.close_all()
+
+    elapsed = _timed_workers(workers, work)
+    results.append(_throughput('wsgi', workers, operations, failures, elapsed))
+
+    handler = ASGIHandler()
+    failures = []
+
+    async def client(number):
+        requests = cycle(CATALOG_REQUESTS[number % len(CATALOG_REQUESTS):] + CATALOG_REQUESTS)
+        for _ in range(operations):
+            if await _asgi_get(handler, *next(requests)) != 200:
+                failures.append(number)
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(workers)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    results.append(_throughput('asgi', workers, operations, failures, elapsed))
+    return results
+
+
+def _throughput(label, workers, operations, failures, elapsed):
+    served = workers * operations - len(failures)
+    return {
+        'config': label,
+        'workers': workers,
+        'served': served,
+        'failed': len(failures),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(served / elapsed, 1),
+    }
+
+
+MESSAGE_STORAGES = {
+    'db': 'django.contrib.messages.storage.session.SessionStorage',
+    'cached_db': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'signed_cookies': 'django.contrib.messages.storage.cookie.CookieStorage',
+}
+
+
+def _admin_requests(client, operations):
+    """An admin's round: dashboard, catalog, add a book (flash message), its listing."""
+    for n in range(operations):
+        step = n % 4
+        if step == 0:
+            client.get(reverse('admin_dashboard'))
+        elif step == 1:
+            client.get(reverse('list_books_admin'))
+        elif step == 2:
+            client.post(reverse('add_book'), {'title': f'Bench {n}', 'author': 'Bench', 'genre': 'Bench', 'status': 'available'})
+        else:
+            client.get(reverse('list_books'))
+
+
+def session_queries(workers=8, operations=200):
+    """Database queries per request under each session mode (settings.SESSION_ENGINES).
+
+    ``workers`` logged-in admins each make ``operations`` requests in turn.
+    Everything runs in one transaction that is rolled back, so the
+    configured database is left as it was.
+    """
+    from .models import CustomUser
+
+    results = []
+    for mode, engine in settings.SESSION_ENGINES.items():
+        with override_settings(SESSION_ENGINE=engine, MESSAGE_STORAGE=MESSAGE_STORAGES[mode]), transaction.atomic():
+            clients = []
+            for number in range(workers):
+                client = Client(SERVER_NAME=BENCH_HOST)
+                client.force_login(CustomUser.objects.create(username=f'bench-{mode}-{number}', role='admin'))
+                clients.append(client)
+
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                for client in clients:
+                    _admin_requests(client, operations)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        requests = workers * operations
+        session_hits = [query for query in queries if 'django_session' in query['sql']]
+        results.append({
+            'config': mode,
+            'requests': requests,
+            'queries_per_request': round(len(queries) / requests, 2),
+            'session_queries_per_request': round(len(session_hits) / requests, 2),
+            'seconds': round(elapsed, 3),
+        })
+    return results
+
+
+def login_throttle(workers=8, operations=200):
+    """CPU time per login attempt that is hashed vs one the throttle rejects.
+
+    ``workers`` attacking IPs each POST ``operations`` wrong passwords
+    through the full stack, for a new username each time, so the per-IP
+    bucket is what trips. CPU time is ``time.process_time()`` per request.
+    """
+    from . import throttle
+
+    cpu = {'processed': 0.0, 'rejected': 0.0}
+    count = {'processed': 0, 'rejected': 0}
+    for number in range(workers):
+        ip = f'198.51.100.{number % 256}'
+        cache_keys = [throttle.BUCKET_KEY.format('ip', ip)]
+        cache_keys += [throttle.BUCKET_KEY.format('username', f'bench-victim-{n}') for n in range(operations)]
+        throttle.cache.delete_many(cache_keys)
+        client = Client(SERVER_NAME=BENCH_HOST, REMOTE_ADDR=ip)
+        for n in range(operations):
+            started = time.process_time()
+            response = client.post(reverse('login'), {'username': f'bench-victim-{n}', 'password': 'wrong'})
+            outcome = 'rejected' if response.status_code == 429 else 'processed'
+            cpu[outcome] += time.process_time() - started
+            count[outcome] += 1
+
+    return [
+        {
+            'config': outcome,
+            'requests': count[outcome],
+            'cpu_ms_per_request': round(1000 * cpu[outcome] / count[outcome], 3) if count[outcome] else None,
+        }
+        for outcome in ('processed', 'rejected')
+    ]
+
+
+# name -> (role of the client, method, URL, query budget per request).
+# URLs are built per repetition from ``ctx``: the book to borrow and the
+# loan that borrow opened. Budgets are the worst case, a cold fragment
+# cache included.
+VIEW_CASES = {
+    'book_list': ('student', 'get', lambda ctx: reverse('book_list'), 7),
+    'book_list_search': ('student', 'get', lambda ctx: reverse('book_list') + '?search=garden', 7),
+    'book_list_fuzzy': ('student', 'get', lambda ctx: reverse('book_list') + '?search=gardn+moom', 8),
+    'book_list_facets': ('student', 'get', lambda ctx: reverse('book_list') + '?genre=Fiction&status=available', 7),
+    'list_books_student': ('student', 'get', lambda ctx: reverse('list_books_student'), 3),
+    'borrow_book': ('student', 'post', lambda ctx: reverse('borrow_book', args=[ctx['book_id']]), 8),
+    'return_book': ('student', 'post', lambda ctx: reverse('return_book', args=[ctx['loan_id']]), 8),
+    'view_users': ('admin', 'get', lambda ctx: reverse('view_users'), 5),
+    'view_users_overdue': ('admin', 'get', lambda ctx: reverse('view_users') + '?overdue=1', 5),
+    'student_dashboard': ('student', 'get', lambda ctx: reverse('student_dashboard'), 5),
+    'admin_dashboard': ('admin', 'get', lambda ctx: reverse('admin_dashboard'), 3),
+    'superadmin_dashboard': ('super_admin', 'get', lambda ctx: reverse('superadmin_dashboard'), 4),
+    'api_books': ('student', 'get', lambda ctx: reverse('api_books'), 4),
+    'api_book_search': ('student', 'get', lambda ctx: reverse('api_book_search') + '?search=garden', 4),
+}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_view_benchmarks(repeat=20, cases=None):
+    """Latency and query counts for each view in VIEW_CASES, via the test client.
+
+    Meant for a catalog filled by ``manage.py seed_library``. Fresh users of
+    each role make ``repeat`` rounds of requests, one per view, starting
+    from a cold catalog cache; each round borrows a different available
+    book and returns it again. Everything runs in one transaction that is
+    rolled back. Returns one result dict per view.
+    """
+    from .catalog_cache import bump_catalog_version
+    from .models import Book, BorrowedBook, CustomUser
+
+    names = [name for name in VIEW_CASES if not cases or name in cases]
+    timings = {name: [] for name in names}
+    query_counts = {name: [] for name in names}
+    with transaction.atomic():
+        clients, users = {}, {}
+        for role in ('student', 'admin', 'super_admin'):
+            users[role] = CustomUser.objects.create(username=f'bench-views-{role}', role=role)
+            clients[role] = Client(SERVER_NAME=BENCH_HOST)
+            clients[role].force_login(users[role])
+        available = list(Book.objects.filter(status='available').values_list('id', flat=True)[:repeat])
+        if len(available) < repeat:
+            raise RuntimeError(f"Need {repeat} available books; seed the catalog first.")
+        bump_catalog_version()
+
+        for number in range(repeat):
+            ctx = {'book_id': available[number]}
+            for name in names:
+                role, method, url, _ = VIEW_CASES[name]
+                if name == 'return_book':
+                    if 'borrow_book' not in names:
+                        clients['student'].post(reverse('borrow_book', args=[ctx['book_id']]))
+                    ctx['loan_id'] = BorrowedBook.objects.get(book_id=ctx['book_id'], returned_at__isnull=True).id
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(clients[role], method)(url(ctx))
+                timings[name].append(time.perf_counter() - started)
+                query_counts[name].append(len(queries))
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{name}: {method.upper()} {url(ctx)} answered {response.status_code}")
+            if 'borrow_book' in names and 'return_book' not in names:
+                # Stay under the loan limit for the next round
+                loan = BorrowedBook.objects.get(book_id=ctx['book_id'], returned_at__isnull=True)
+                clients['student'].post(reverse('return_book', args=[loan.id]))
+        transaction.set_rollback(True)
+
+    return [
+        {
+            'view': name,
+            'requests': repeat,
+            'median_ms': round(1000 * statistics.median(timings[name]), 2),
+            'p95_ms': round(1000 * _percentile(timings[name], 0.95), 2),
+            'max_queries': max(query_counts[name]),
+            'budget': VIEW_CASES[name][3],
+        }
+        for name in names
+    ]
+
+
+def check_results(results, baseline=None, max_regression=0.25):
+    """Return a message for every view that breaks its query budget or regressed.
+
+    Against ``baseline`` (earlier results, for example a saved JSON file) a
+    view fails if it now runs more queries, or if its median latency grew
+    by more than ``max_regression`` (0.25 = 25%).
+    """
+    before = {row['view']: row for row in baseline or ()}
+    failures = []
+    for row in results:
+        if row['max_queries'] > row['budget']:
+            failures.append(f"{row['view']}: {row['max_queries']} queries, budget is {row['budget']}")
+        old = before.get(row['view'])
+        if old is None:
+            continue
+        if row['max_queries'] > old['max_queries']:
+            failures.append(f"{row['view']}: {row['max_queries']} queries, baseline had {old['max_queries']}")
+        if row['median_ms'] and old['median_ms'] and row['median_ms'] > old['median_ms'] * (1 + max_regression):
+            failures.append(f"{row['view']}: median {row['median_ms']} ms, baseline was {old['median_ms']} ms")
+    return failures
+
+
+def _checkout_round(client, book_ids, batch):
+    """Borrow ``book_ids`` and return them again, per book or as one batch each way."""
+    from .models import BorrowedBook
+
+    if batch:
+        client.post(reverse('checkout_books'), {'book_ids': book_ids})
+    else:
+        for book_id in book_ids:
+            client.post(reverse('borrow_book', args=[book_id]))
+    loan_ids = list(BorrowedBook.objects.filter(book__in=book_ids, returned_at__isnull=True).values_list('id', flat=True))
+    if batch:
+        client.post(reverse('return_books'), {'loan_ids': loan_ids})
+    else:
+        for loan_id in loan_ids:
+            client.post(reverse('return_book', args=[loan_id]))
+
+
+def batch_checkout(workers=8, operations=200):
+    """Queries and time to borrow and return three books: one request per book vs one batch each way.
+
+    ``workers`` students each make ``operations`` rounds on their own three
+    available books. Everything runs in a transaction that is rolled back.
+    """
+    from .loans import MAX_OPEN_LOANS
+    from .models import Book, CustomUser
+
+    results = []
+    for batch in (False, True):
+        with transaction.atomic():
+            books = list(Book.objects.filter(status='available').values_list('id', flat=True)[:workers * MAX_OPEN_LOANS])
+            if len(books) < workers * MAX_OPEN_LOANS:
+                raise RuntimeError(f"Need {workers * MAX_OPEN_LOANS} available books; seed the catalog first.")
+            clients = []
+            for number in range(workers):
+                client = Client(SERVER_NAME=BENCH_HOST)
+                client.force_login(CustomUser.objects.create(username=f'bench-cart-{number}', role='student'))
+                clients.append((client, books[number * MAX_OPEN_LOANS:(number + 1) * MAX_OPEN_LOANS]))
+
+            # Counted as they run: CaptureQueriesContext stops counting once
+            # the connection's query log holds its 9000 entries
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            started = time.perf_counter()
+            with connection.execute_wrapper(count):
+                for _ in range(operations):
+                    for client, book_ids in clients:
+                        _checkout_round(client, book_ids, batch)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        rounds = workers * operations
+        results.append({
+            'config': 'batch' if batch else 'per-book',
+            'rounds': rounds,
+            'queries_per_round': round(len(queries) / rounds, 2),
+            'ms_per_round': round(1000 * elapsed / rounds, 2),
+        })
+    return results
+
+
+TYPEAHEAD_TITLES = 1000000
+SYLLABLES = "ka lo mi ren ta vo shi da ne ru bel cor an tis mor el fa gun pri sol ve".split()
+
+
+def _typeahead_catalog(rng, count):
+    """``count`` synthetic (title, author) rows, nearly all distinct."""
+    words = [''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(20000)]
+    authors = [f"{rng.choice(words).title()} {rng.choice(words).title()}" for _ in range(count // 10)]
+    for _ in range(count):
+        title = ' '.join(rng.choices(words, k=rng.randint(1, 5))).title()
+        yield ('The ' + title if rng.random() < 0.1 else title), rng.choice(authors)
+
+
+def typeahead(workers=8, operations=200):
+    """Prefix-index suggestions vs an icontains query, per lookup.
+
+    Builds a PrefixIndex over TYPEAHEAD_TITLES synthetic titles and their
+    authors (in memory, not from the database), then ``workers`` threads
+    each look up ``operations`` prefixes of 1-6 characters taken from real
+    keys. The icontains row runs the same prefixes as a title query
+    against the configured database, for comparison; seed it first.
+    """
+    import random
+    import tracemalloc
+
+    from .models import Book
+    from .typeahead import PrefixIndex
+
+    rng = random.Random(0)
+    rows = list(_typeahead_catalog(rng, TYPEAHEAD_TITLES))
+    started = time.perf_counter()
+    index = PrefixIndex(max_keys=len(rows) * 3).load(rows)
+    build_seconds = time.perf_counter() - started
+    del index
+    tracemalloc.start()
+    index = PrefixIndex(max_keys=len(rows) * 3).load(rows)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+
+    prefixes = [
+        [key[:rng.randint(1, 6)] for key in rng.choices(index.keys, k=operations)]
+        for _ in range(workers)
+    ]
+    timings = [[] for _ in range(workers)]
+
+    def work(number):
+        for prefix in prefixes[number]:
+            started = time.perf_counter()
+            index.lookup(prefix)
+            timings[number].append(time.perf_counter() - started)
+
+    _timed_workers(workers, work)
+    index_timings = [timing for worker in timings for timing in worker]
+
+    db_timings = []
+    for prefix in prefixes[0][:min(operations, 50)]:
+        started = time.perf_counter()
+        list(Book.objects.filter(title__icontains=prefix).values_list('title', flat=True)[:8])
+        db_timings.append(time.perf_counter() - started)
+
+    return [
+        {
+            'config': 'prefix-index',
+            'keys': len(index),
+            'lookups': len(index_timings),
+            'median_us': round(1e6 * statistics.median(index_timings), 1),
+            'p99_us': round(1e6 * _percentile(index_timings, 0.99), 1),
+            'build_seconds': round(build_seconds, 2),
+            'memory_mb': round(memory / 2 ** 20, 1),
+        },
+        {
+            'config': 'icontains',
+            'keys': Book.objects.count(),
+            'lookups': len(db_timings),
+            'median_us': round(1e6 * statistics.median(db_timings), 1),
+            'p99_us': round(1e6 * _percentile(db_timings, 0.99), 1),
+            'build_seconds': None,
+            'memory_mb': None,
+        },
+    ]
+
+
+BENCHMARKS = {
+    'sqlite-writes': sqlite_writes,
+    'wsgi-vs-asgi': wsgi_vs_asgi,
+    'session-queries': session_queries,
+    'login-throttle': login_throttle,
+    'typeahead': typeahead,
+    'batch-checkout': batch_checkout,
+}
@@ -0,0 +1,74 @@
+# library/catalog_cache.py
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Rendered catalog fragments are cached under keys that include the current
+# catalog version. Any change a reader could see - a book added, edited or
+# deleted, a status flip from borrow/return, a new rating - bumps the
+# version, so every old fragment simply stops being looked up and ages out.
+VERSION_KEY = 'library:catalog_version'
+
+
+def get_cache():
+    # Same cache the {% cache %} template tag stores fragments in
+    if 'template_fragments' in settings.CACHES:
+        return caches['template_fragments']
+    return caches['default']
+
+
+def catalog_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than 1 so a version lost to eviction
+        # or a restart never reuses a number an old fragment was stored under.
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    """catalog_version() through the cache's async API, for async views."""
+    cache = get_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = get_cache()
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        catalog_version()
+        return cache.incr(VERSION_KEY)
+
+
+def invalidate_catalog():
+    """Bump the catalog version once the current transaction commits.
+
+    Bumping before commit would let a concurrent request re-cache the old
+    rows under the new version.
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+def catalog_context():
+    """Template context the catalog fragments are keyed on."""
+    return {
+        'catalog_version': catalog_version(),
+        'catalog_cache_timeout': getattr(settings, 'LIBRARY_CATALOG_CACHE_TIMEOUT', 300),
+    }
+
+
+async def acatalog_context():
+    return {
+        'catalog_version': await acatalog_version(),
+        'catalog_cache_timeout': getattr(settings, 'LIBRARY_CATALOG_CACHE_TIMEOUT', 300),
+    }
@@ -1,12 +1,63 @@
 # library/decorators.py
 
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
 from django.http import HttpResponseForbidden # type: ignore
 
+from .routers import ais_pinned, is_pinned, reading_from_replica
+
+
+async def resolve_user(request):
+    """Load ``request.user`` with the async ORM and keep it on the request.
+
+    ``request.user`` is lazy and would hit the database synchronously the
+    first time a view or template (``{{ user }}``) touches it, which is not
+    allowed inside an async view.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
 def role_required(allowed_roles):
     def decorator(view_func):
-        def _wrapped_view(request, *args, **kwargs):
-            if request.user.role not in allowed_roles:
-                return HttpResponseForbidden("You are not authorized to view this page.")
-            return view_func(request, *args, **kwargs)
-        return _wrapped_view
+        if iscoroutinefunction(view_func):
+            async def _wrapped_view(request, *args, **kwargs):
+                user = await resolve_user(request)
+                if user.role not in allowed_roles:
+                    return HttpResponseForbidden("You are not authorized to view this page.")
+                return await view_func(request, *args, **kwargs)
+        else:
+            def _wrapped_view(request, *args, **kwargs):
+                if request.user.role not in allowed_roles:
+                    return HttpResponseForbidden("You are not authorized to view this page.")
+                return view_func(request, *args, **kwargs)
+        return wraps(view_func)(_wrapped_view)
     return decorator
+
+
+def read_replica(view_func):
+    """Serve the view's library reads from the read replica.
+
+    Only for views that never write. Users who wrote recently are pinned to
+    the primary (see routers.pin_to_primary) so they see their own changes.
+    Works on async views too: the async ORM's worker threads inherit the
+    routing context.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            user = await resolve_user(request)
+            if user.is_authenticated and await ais_pinned(user.id):
+                return await view_func(request, *args, **kwargs)
+            with reading_from_replica():
+                return await view_func(request, *args, **kwargs)
+        return _wrapped_view
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.user.is_authenticated and is_pinned(request.user.id):
+            return view_func(request, *args, **kwargs)
+        with reading_from_replica():
+            return view_func(request, *args, **kwargs)
+    return _wrapped_view
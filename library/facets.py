@@ -0,0 +1,100 @@
+# library/facets.py
+"""
+Facet counts for the book_list search page.
+
+Each facet counts the books matching the current search and every other
+active filter, grouped by that facet's column, so picking a genre still
+shows how many books the other genres would give. That is one GROUP BY
+query per facet, limited to the FACET_LIMIT largest values; genre and
+status group on their indexes.
+
+Results are cached per normalized filter combination under the catalog
+version (library.catalog_cache), so any catalog change retires them.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Count
+
+from .catalog_cache import acatalog_version, get_cache
+from .search import TOKEN_RE
+
+# Filter parameter -> lookup. genre and status are exact so they can use
+# book_genre_idx / book_status_idx; author stays a substring match.
+FILTERS = {
+    'genre': 'genre',
+    'author': 'author__icontains',
+    'status': 'status',
+}
+
+FACET_LIMIT = 20
+
+FACETS_KEY = 'library:facets:{}:{}'
+
+
+def normalize(params):
+    """The search and filters in ``params`` in canonical form: the cache key's input."""
+    return {
+        'search': ' '.join(TOKEN_RE.findall(params.get('search', '').lower())),
+        'genre': params.get('genre', '').strip(),
+        'author': params.get('author', '').strip().lower(),
+        'status': params.get('status', '').strip(),
+    }
+
+
+def apply_filters(books, params, skip=None):
+    """Apply the ?genre=, ?author= and ?status= filters, all but ``skip``."""
+    for name, lookup in FILTERS.items():
+        value = params.get(name, '').strip()
+        if value and name != skip:
+            books = books.filter(**{lookup: value})
+    return books
+
+
+def facet_queries(searched, params):
+    """{facet: queryset of {facet: value, 'count': n}} over ``searched`` (already searched, unfiltered)."""
+    return {
+        name: (
+            apply_filters(searched, params, skip=name)
+            .order_by()
+            .values(name)
+            .annotate(count=Count('id'))
+            .order_by('-count', name)[:FACET_LIMIT]
+        )
+        for name in FILTERS
+    }
+
+
+async def _akey(params):
+    filters = json.dumps(normalize(params), sort_keys=True)
+    return FACETS_KEY.format(await acatalog_version(), hashlib.sha1(filters.encode()).hexdigest())
+
+
+def with_selected(facets, params):
+    """Append the active genre and status when FACET_LIMIT cut them off, with no count.
+
+    The form's selects are built from the facets; without this a selected
+    value outside the top ones would be dropped when the form is resent.
+    """
+    facets = dict(facets)
+    for name in ('genre', 'status'):
+        value = params.get(name, '').strip()
+        if value and value not in {listed for listed, _ in facets[name]}:
+            facets[name] = [*facets[name], (value, None)]
+    return facets
+
+
+async def afacet_counts(searched, params):
+    """{facet: [(value, count), ...]} for the book_list page, from the cache when possible."""
+    cache = get_cache()
+    key = await _akey(params)
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = {
+            name: [(row[name], row['count']) async for row in queryset]
+            for name, queryset in facet_queries(searched, params).items()
+        }
+        await cache.aset(key, facets, getattr(settings, 'LIBRARY_CATALOG_CACHE_TIMEOUT', 300))
+    return with_selected(facets, params)
@@ -0,0 +1,162 @@
+# library/fuzzy.py
+"""
+Typo-tolerant search over title, author and genre with a trigram index.
+
+Each book's words are cut into trigrams (padded as "  word ", so word
+starts weigh more) and stored in BookTrigram. A fuzzy query looks up the
+posting lists of its own trigrams through the (trigram, book) index and
+keeps the books that share at least THRESHOLD of them, best first. No
+edit distance is computed.
+
+Word-start trigrams such as "  s" are in a large share of the catalog, so
+a first query counts each query trigram's postings, stopping past
+POSTING_LIMIT. When the common trigrams alone cannot make a match, the
+candidates come from the rare ones only: a match lacking every common
+trigram needs that many fewer rare ones, so none is lost. Otherwise every
+posting list is read but cut at the limit, so a query made mostly of
+common trigrams ranks a sample of its matches. Either way at most
+POSTING_LIMIT + 1 rows are read per trigram, however large the catalog.
+
+The rows are rewritten on every Book save that changes the text (see
+library.signals); bulk_create paths call index_books() themselves and
+`manage.py build_trigrams` rebuilds the whole table.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Book, BookTrigram
+from .typeahead import normalize
+
+# Share of the query's trigrams a book must contain to match
+THRESHOLD = 0.4
+# Best candidates considered per query, so common trigrams stay cheap to rank
+MAX_CANDIDATES = 200
+# Postings read per query trigram; a trigram with more is too common to probe
+POSTING_LIMIT = 500
+
+
+def trigrams(*texts):
+    grams = set()
+    for text in texts:
+        for word in normalize(text or '').split():
+            padded = f'  {word} '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _rows(books):
+    for book in books:
+        grams = trigrams(book.title, book.author, book.genre)
+        for gram in grams:
+            yield book.pk, gram, len(grams)
+
+
+def _insert(rows):
+    # Plain executemany: building a model instance per trigram would cost
+    # several times the insert itself.
+    table = BookTrigram._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} (book_id, trigram, total) VALUES (%s, %s, %s)', rows)
+
+
+def index_books(books):
+    """(Re)write the trigram rows of ``books`` (saved Book instances)."""
+    books = list(books)
+    with transaction.atomic():
+        BookTrigram.objects.filter(book__in=[book.pk for book in books]).delete()
+        _insert(list(_rows(books)))
+
+
+def rebuild_trigrams(batch_size=5000):
+    """Rebuild the whole trigram table from the catalog. Returns the number of books indexed."""
+    indexed = 0
+    rows = []
+    with transaction.atomic():
+        BookTrigram.objects.all().delete()
+        for book in Book.objects.only('id', 'title', 'author', 'genre').order_by('id').iterator(chunk_size=2000):
+            rows.extend(_rows([book]))
+            indexed += 1
+            if len(rows) >= batch_size:
+                _insert(rows)
+                rows = []
+        _insert(rows)
+    return indexed
+
+
+def fuzzy_match(queryset, text, first=()):
+    """Books in ``queryset`` sharing at least THRESHOLD of ``text``'s trigrams.
+
+    Annotated with ``trigram_score`` (the share found, 0-1) and with
+    ``search_rank`` = -score, so results sort and paginate like FTS hits.
+    The ids in ``first`` (exact hits, best first) are always included and
+    rank ahead of every close match.
+    """
+    first = list(first)
+    grams = trigrams(text)
+    if not grams:
+        return queryset.filter(id__in=first).annotate(trigram_score=Value(1.0), search_rank=_first_rank(first))
+    minimum = max(1, round(THRESHOLD * len(grams)))
+    counts = _posting_counts(grams)
+    rare = sorted(gram for gram in grams if counts[gram] <= POSTING_LIMIT)
+    common = len(grams) - len(rare)
+    if common < minimum:
+        probed, needed = rare, minimum - common
+    else:
+        probed, needed = sorted(grams), minimum
+    candidates = _candidates(probed, needed)
+    shared = (
+        BookTrigram.objects.filter(book=OuterRef('pk'), trigram__in=grams)
+        .values('book')
+        .annotate(shared=Count('id'))
+        .values('shared')
+    )
+    return (
+        queryset.filter(Q(id__in=candidates) | Q(id__in=first))
+        .annotate(trigram_score=ExpressionWrapper(Subquery(shared) / Value(float(len(grams))), output_field=FloatField()))
+        # The candidates only had to clear a lower bound on the rare trigrams
+        .filter(Q(trigram_score__gte=THRESHOLD) | Q(id__in=first))
+        .annotate(search_rank=_first_rank(first, default=-F('trigram_score')))
+    )
+
+
+def _first_rank(ids, default=Value(0.0)):
+    # Close matches rank in [-1, -THRESHOLD]; exact hits below -1, in order
+    whens = [When(id=book_id, then=Value(-2.0 - len(ids) + position)) for position, book_id in enumerate(ids)]
+    return Case(*whens, default=default, output_field=FloatField()) if whens else ExpressionWrapper(default, output_field=FloatField())
+
+
+def _postings(grams):
+    table = BookTrigram._meta.db_table
+    # Each arm is wrapped so its LIMIT is allowed inside the UNION ALL
+    return ' UNION ALL '.join(
+        f'SELECT * FROM (SELECT book_id FROM {table} WHERE trigram = %s LIMIT {POSTING_LIMIT + 1}) AS p'
+        for _ in grams
+    )
+
+
+def _posting_counts(grams):
+    """{trigram: books containing it}, counted no higher than POSTING_LIMIT + 1."""
+    table = BookTrigram._meta.db_table
+    grams = sorted(grams)
+    sql = ' UNION ALL '.join(
+        f'SELECT %s, (SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE trigram = %s LIMIT {POSTING_LIMIT + 1}) AS p)'
+        for _ in grams
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for gram in grams for value in (gram, gram)])
+        return dict(cursor.fetchall())
+
+
+def _candidates(grams, needed):
+    """Ids of the books sharing ``needed`` of ``grams``, most shared first, as a subquery."""
+    sql = (
+        f'SELECT book_id FROM ({_postings(grams)}) AS postings GROUP BY book_id '
+        f'HAVING COUNT(*) >= %s ORDER BY COUNT(*) DESC, book_id LIMIT {MAX_CANDIDATES}'
+    )
+    return RawSQL(sql, [*grams, needed])
+
+
+def is_fuzzy(queryset):
+    return 'trigram_score' in queryset.query.annotations
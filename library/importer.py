@@ -0,0 +1,130 @@
+# library/importer.py
+
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import transaction
+
+from .catalog_cache import invalidate_catalog
+from .forms import BookForm
+from .fuzzy import index_books
+from .models import Book
+
+FIELDS = BookForm.Meta.fields
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def read_csv(stream):
+    """Yield (line number, row dict) from a CSV file with a header row."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    """Yield (line number, row dict) from a JSON Lines file; bad lines yield None."""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def validate(rows, stats, on_error=None):
+    """Yield unsaved Book instances for rows that pass BookForm validation."""
+    for line_number, row in rows:
+        stats.read += 1
+        if row is None:
+            stats.invalid += 1
+            if on_error:
+                on_error(line_number, "not a JSON object")
+            continue
+        # JSON values may be numbers (a title like 1984); the form takes text
+        data = {field: '' if row.get(field) is None else str(row[field]).strip() for field in FIELDS}
+        form = BookForm(data=data)
+        if not form.is_valid():
+            stats.invalid += 1
+            if on_error:
+                on_error(line_number, form.errors.as_text())
+            continue
+        yield form.save(commit=False)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def drop_duplicates(batches, stats):
+    """Drop books whose exact title+author already exist in the catalog or batch.
+
+    Only the current batch is held in memory: earlier batches are already
+    committed, so they are caught by the catalog lookup.
+    """
+    for batch in batches:
+        titles = {book.title for book in batch}
+        existing = set(Book.objects.filter(title__in=titles).values_list('title', 'author'))
+        fresh = []
+        for book in batch:
+            key = (book.title, book.author)
+            if key in existing:
+                stats.duplicates += 1
+                continue
+            existing.add(key)
+            fresh.append(book)
+        yield fresh
+
+
+def import_books(stream, fmt='csv', batch_size=1000, on_error=None, on_batch=None):
+    """Stream books from ``stream`` into the catalog and return ImportStats.
+
+    The pipeline is read -> validate -> batch -> dedupe -> bulk_create, all
+    generators, so only one batch is ever in memory. Each batch is written
+    with bulk_create in its own transaction; ``on_batch(stats)`` is called
+    after every commit.
+    """
+    stats = ImportStats()
+    books = validate(READERS[fmt](stream), stats, on_error)
+    for batch in drop_duplicates(batched(books, batch_size), stats):
+        if batch:
+            with transaction.atomic():
+                Book.objects.bulk_create(batch, batch_size=batch_size)
+                # bulk_create skips signals; the FTS table has its own triggers
+                index_books(batch)
+                invalidate_catalog()
+            stats.created += len(batch)
+        if on_batch:
+            on_batch(stats)
+    return stats
@@ -0,0 +1,243 @@
+# library/loans.py
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.http import Http404
+from django.utils import timezone
+
+from .auth import forget_user
+from .catalog_cache import invalidate_catalog
+from .models import Book, BorrowedBook, CustomUser, NeighbourRefresh
+
+LOAN_PERIOD = timedelta(days=14)
+MAX_OPEN_LOANS = 3
+
+
+class LoanError(Exception):
+    """A borrow or return that was refused; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def loan_limit(role):
+    """Open loans allowed for ``role`` (settings.LIBRARY_LOAN_LIMITS, default 3)."""
+    return getattr(settings, 'LIBRARY_LOAN_LIMITS', {}).get(role, MAX_OPEN_LOANS)
+
+
+def borrow(user, book_id):
+    """Lend book ``book_id`` to ``user`` and return the new BorrowedBook.
+
+    The book is claimed with a conditional ``UPDATE ... WHERE status =
+    'available'`` so of any number of concurrent requests for the same copy
+    exactly one flips the row; everyone else sees zero rows updated. The
+    loan limit is enforced the same way, by incrementing the user's
+    ``active_loans`` only ``WHERE active_loans < limit``. Both updates and
+    the loan row share one transaction, so a refused borrow undoes the
+    other.
+    """
+    with transaction.atomic():
+        claimed = Book.objects.filter(id=book_id, status='available').update(status='borrowed', updated_at=timezone.now())
+        if not claimed:
+            if not Book.objects.filter(id=book_id).exists():
+                raise Http404("No Book matches the given query.")
+            raise LoanError("This book is already borrowed by someone else.")
+
+        limit = loan_limit(user.role)
+        reserved = CustomUser.objects.filter(id=user.id, active_loans__lt=limit).update(
+            active_loans=F('active_loans') + 1,
+        )
+        forget_user(user.id)
+        if not reserved:
+            raise LoanError(f"You can only borrow a maximum of {limit} books at a time.")
+
+        loan = BorrowedBook.objects.create(
+            user=user,
+            book_id=book_id,
+            due_date=timezone.now() + LOAN_PERIOD,
+        )
+        invalidate_catalog()
+        return loan
+
+
+def return_loan(user, borrowed_book_id):
+    """Close loan ``borrowed_book_id`` for ``user`` and make the book available.
+
+    Closing the loan is itself conditional (``returned_at IS NULL``), so a
+    double-submitted return cannot free a copy that was lent out again in
+    between.
+    """
+    with transaction.atomic():
+        returned = BorrowedBook.objects.filter(
+            id=borrowed_book_id, user=user, returned_at__isnull=True,
+        ).update(returned_at=timezone.now())
+        if not returned:
+            loan = BorrowedBook.objects.filter(id=borrowed_book_id).values('user_id').first()
+            if loan is None:
+                raise Http404("No BorrowedBook matches the given query.")
+            if loan['user_id'] != user.id:
+                raise LoanError("You can't return a book you didn't borrow.", status=403)
+            raise LoanError("This book has already been returned.")
+
+        Book.objects.filter(borrowedbook__id=borrowed_book_id).update(status='available', updated_at=timezone.now())
+        CustomUser.objects.filter(id=user.id, active_loans__gt=0).update(
+            active_loans=F('active_loans') - 1,
+        )
+        forget_user(user.id)
+        invalidate_catalog()
+
+
+def _ok(item_id, **extra):
+    return {'id': item_id, 'ok': True, **extra}
+
+
+def _refused(item_id, message):
+    return {'id': item_id, 'ok': False, 'error': message}
+
+
+def borrow_many(user, book_ids):
+    """Lend every book in ``book_ids`` it can to ``user``, in one transaction.
+
+    Returns one result per distinct id, in order: ``{'id', 'ok', 'loan_id'}``
+    or ``{'id', 'ok': False, 'error'}``. The user's row and the books are
+    locked first (SQLite takes the write lock at BEGIN), so the loan limit is
+    checked once for the whole batch; ids past the limit are refused. The
+    accepted books are claimed with one conditional UPDATE, the counter
+    moves once and the loans are bulk inserted.
+    """
+    book_ids = list(dict.fromkeys(book_ids))
+    limit = loan_limit(user.role)
+    now = timezone.now()
+    with transaction.atomic():
+        active = CustomUser.objects.select_for_update().filter(id=user.id).values_list('active_loans', flat=True).get()
+        statuses = dict(Book.objects.select_for_update().filter(id__in=book_ids).values_list('id', 'status'))
+
+        results, accepted = [], []
+        for book_id in book_ids:
+            if book_id not in statuses:
+                results.append(_refused(book_id, "No Book matches the given query."))
+            elif statuses[book_id] != 'available':
+                results.append(_refused(book_id, "This book is already borrowed by someone else."))
+            elif active + len(accepted) >= limit:
+                results.append(_refused(book_id, f"You can only borrow a maximum of {limit} books at a time."))
+            else:
+                accepted.append(book_id)
+                results.append(None)
+        if not accepted:
+            return results
+
+        claimed = Book.objects.filter(id__in=accepted, status='available').update(status='borrowed', updated_at=now)
+        reserved = CustomUser.objects.filter(id=user.id, active_loans__lte=limit - len(accepted)).update(
+            active_loans=F('active_loans') + len(accepted),
+        )
+        forget_user(user.id)
+        if claimed != len(accepted) or not reserved:
+            # Only possible on a backend that ignores the row locks
+            raise LoanError("The catalog changed during checkout; please try again.", status=409)
+
+        loans = BorrowedBook.objects.bulk_create(
+            BorrowedBook(user=user, book_id=book_id, due_date=now + LOAN_PERIOD) for book_id in accepted
+        )
+        loan_ids = iter(loan.id for loan in loans)
+        results = [result or _ok(book_id, loan_id=next(loan_ids)) for book_id, result in zip(book_ids, results)]
+        # bulk_create sends no post_save, so the recommender is queued here
+        NeighbourRefresh.objects.bulk_create(NeighbourRefresh(user=user, book_id=book_id) for book_id in accepted)
+        invalidate_catalog()
+    return results
+
+
+def _close_loans(open_loans, now):
+    """Close the loans in ``open_loans`` (dicts with id, book_id, user_id) with bulk UPDATEs."""
+    BorrowedBook.objects.filter(id__in=[loan['id'] for loan in open_loans], returned_at__isnull=True).update(returned_at=now)
+    Book.objects.filter(id__in=[loan['book_id'] for loan in open_loans]).update(status='available', updated_at=now)
+    per_user = Counter(loan['user_id'] for loan in open_loans)
+    CustomUser.objects.filter(id__in=per_user).update(active_loans=Greatest(
+        Case(*(When(id=user_id, then=F('active_loans') - count) for user_id, count in per_user.items())),
+        Value(0),
+    ))
+    forget_user(*per_user)
+    invalidate_catalog()
+
+
+def return_many(user, loan_ids):
+    """Return every loan in ``loan_ids`` that ``user`` still has open, in one transaction.
+
+    Results are per distinct id, like borrow_many(), with ``book_id`` on
+    each returned loan.
+    """
+    loan_ids = list(dict.fromkeys(loan_ids))
+    with transaction.atomic():
+        loans = {
+            loan['id']: loan for loan in
+            BorrowedBook.objects.select_for_update().filter(id__in=loan_ids).values('id', 'book_id', 'user_id', 'returned_at')
+        }
+        results, closing = [], []
+        for loan_id in loan_ids:
+            loan = loans.get(loan_id)
+            if loan is None:
+                results.append(_refused(loan_id, "No BorrowedBook matches the given query."))
+            elif loan['user_id'] != user.id:
+                results.append(_refused(loan_id, "You can't return a book you didn't borrow."))
+            elif loan['returned_at'] is not None:
+                results.append(_refused(loan_id, "This book has already been returned."))
+            else:
+                closing.append(loan)
+                results.append(_ok(loan_id, book_id=loan['book_id']))
+        if closing:
+            _close_loans(closing, timezone.now())
+    return results
+
+
+def desk_return(book_ids):
+    """Check in a stack of books at the desk: close each book's open loan, whoever holds it.
+
+    Results are per distinct book id, with the ``loan_id`` closed.
+    """
+    book_ids = list(dict.fromkeys(book_ids))
+    with transaction.atomic():
+        known = set(Book.objects.filter(id__in=book_ids).values_list('id', flat=True))
+        loans = {
+            loan['book_id']: loan for loan in
+            BorrowedBook.objects.select_for_update().open().filter(book__in=book_ids).values('id', 'book_id', 'user_id')
+        }
+        results, closing = [], []
+        for book_id in book_ids:
+            if book_id not in known:
+                results.append(_refused(book_id, "No Book matches the given query."))
+            elif book_id not in loans:
+                results.append(_refused(book_id, "This book is not on loan."))
+            else:
+                closing.append(loans[book_id])
+                results.append(_ok(book_id, loan_id=loans[book_id]['id']))
+        if closing:
+            _close_loans(closing, timezone.now())
+    return results
+
+
+def reconcile_active_loans(dry_run=False):
+    """Rebuild CustomUser.active_loans from the open BorrowedBook rows.
+
+    Only users whose counter disagrees are rewritten, in one UPDATE.
+    Returns the number of users that had drifted.
+    """
+    open_loans = (
+        BorrowedBook.objects.filter(user=OuterRef('pk'), returned_at__isnull=True)
+        .order_by()
+        .values('user')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    expected = Coalesce(Subquery(open_loans, output_field=IntegerField()), Value(0))
+    drifted = CustomUser.objects.annotate(expected=expected).exclude(active_loans=F('expected'))
+
+    drifted_count = drifted.count()
+    if drifted_count and not dry_run:
+        forget_user(*drifted.values_list('pk', flat=True))
+        CustomUser.objects.filter(pk__in=drifted.values('pk')).update(active_loans=expected)
+    return drifted_count
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.benchmarks import VIEW_CASES, check_results, run_view_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Time every main view against the current (seeded) database and enforce query budgets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*', help="Views to run (default: all): " + ', '.join(VIEW_CASES))
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per view.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="Fail on regressions against results saved in this JSON file.")
+        parser.add_argument('--max-regression', type=float, default=0.25, help="Allowed median slowdown (0.25 = 25%%).")
+
+    def handle(self, *args, **options):
+        unknown = set(options['views']) - set(VIEW_CASES)
+        if unknown:
+            raise CommandError(f"Unknown view(s): {', '.join(sorted(unknown))}")
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as source:
+                    baseline = json.load(source)['results']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {error}")
+
+        results = run_view_benchmarks(repeat=options['repeat'], cases=options['views'])
+        for row in results:
+            self.stdout.write(
+                f"{row['view']:<22} median {row['median_ms']:>8} ms  p95 {row['p95_ms']:>8} ms  "
+                f"queries {row['max_queries']}/{row['budget']}"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                json.dump({'repeat': options['repeat'], 'results': results}, target, indent=2)
+
+        failures = check_results(results, baseline, options['max_regression'])
+        if failures:
+            raise CommandError("View benchmarks failed:\n" + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} view(s) within budget."))
@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from library.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run one of the library micro-benchmarks and print its results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS))
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent workers.")
+        parser.add_argument('--operations', type=int, default=200, help="Operations per worker.")
+        parser.add_argument('--json', action='store_true', help="Print raw JSON results.")
+
+    def handle(self, *args, **options):
+        results = BENCHMARKS[options['name']](workers=options['workers'], operations=options['operations'])
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        columns = list(results[0])
+        widths = [max(len(str(column)), *(len(str(row[column])) for row in results)) for column in columns]
+        self.stdout.write('  '.join(str(column).ljust(width) for column, width in zip(columns, widths)))
+        for row in results:
+            self.stdout.write('  '.join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
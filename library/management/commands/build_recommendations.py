@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.recommendations import TOP_K, rebuild_neighbours, refresh_pending, sparse
+
+
+class Command(BaseCommand):
+    help = "Rebuild the \"borrowers of this also borrowed\" neighbours of every book from the loan history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Neighbours kept per book.")
+        parser.add_argument(
+            '--no-vectorize', action='store_true',
+            help="Use the pure-Python path even when NumPy and SciPy are installed.",
+        )
+        parser.add_argument(
+            '--pending', action='store_true',
+            help="Only recompute the rows touched by loans and ratings queued since the last run (run it every few minutes).",
+        )
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1:
+            raise CommandError("--top-k must be at least 1.")
+        vectorized = sparse is not None and not options['no_vectorize']
+        how = "NumPy/SciPy" if vectorized else "pure Python"
+        if options['pending']:
+            rows = refresh_pending(k=options['top_k'], vectorized=vectorized)
+            self.stdout.write(self.style.SUCCESS(f"Refreshed neighbours for {rows} book(s) ({how})."))
+            return
+        books = rebuild_neighbours(k=options['top_k'], vectorized=vectorized)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt neighbours for {books} book(s) ({how})."))
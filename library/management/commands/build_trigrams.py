@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.fuzzy import rebuild_trigrams
+
+
+class Command(BaseCommand):
+    help = "Rebuild the trigram index that typo-tolerant search falls back to."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Trigram rows written per batch.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        books = rebuild_trigrams(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed trigrams for {books} book(s)."))
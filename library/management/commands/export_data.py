@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library import exports
+
+
+class Command(BaseCommand):
+    help = "Stream books, users or loan history to CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', choices=sorted(exports.STREAMERS), default='csv')
+        parser.add_argument('--output', '-o', help="File to write (default: stdout).")
+        parser.add_argument('--since', help="Earliest date/datetime (users: joined, loans: borrowed).")
+        parser.add_argument('--until', help="Latest date/datetime, inclusive.")
+        parser.add_argument('--status', help="books: available/borrowed, loans: open/returned, users: active/banned.")
+        parser.add_argument('--genre')
+        parser.add_argument('--role')
+
+    def handle(self, *args, **options):
+        try:
+            columns, rows = exports.export_rows(
+                options['kind'],
+                since=options['since'],
+                until=options['until'],
+                status=options['status'],
+                genre=options['genre'],
+                role=options['role'],
+            )
+        except exports.ExportError as error:
+            raise CommandError(error)
+
+        chunks = exports.STREAMERS[options['format']](columns, rows)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
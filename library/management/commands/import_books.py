@@ -0,0 +1,49 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.importer import READERS, import_books
+
+
+class Command(BaseCommand):
+    help = "Stream books from a CSV or JSON Lines file into the catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help="Input format (default: from the file extension, csv for stdin).",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        def on_error(line_number, message):
+            self.stderr.write(f"line {line_number}: {message.strip()}")
+
+        def on_batch(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stats.read} rows read, {stats.created} created ({stats.rate:.0f} rows/sec)")
+
+        if path == '-':
+            stats = import_books(sys.stdin, fmt, options['batch_size'], on_error, on_batch)
+        else:
+            try:
+                stream = open(path, newline='', encoding='utf-8')
+            except OSError as error:
+                raise CommandError(error)
+            with stream:
+                stats = import_books(stream, fmt, options['batch_size'], on_error, on_batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.created} book(s) from {stats.read} row(s): "
+            f"{stats.duplicates} duplicate(s), {stats.invalid} invalid, "
+            f"{stats.elapsed:.2f}s ({stats.rate:.0f} rows/sec)."
+        ))
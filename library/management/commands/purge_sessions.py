@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.sessions import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions from the database in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep purging every INTERVAL seconds instead of once.",
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        while True:
+            deleted = purge_expired_sessions(batch_size=options['batch_size'])
+            self.stdout.write(f"Purged {deleted} expired session(s).")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from library.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored rating totals on Book from Review and BorrowedBook ratings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many books have drifted.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = recompute_ratings(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"{drifted} book(s) have drifted rating totals.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Repaired rating totals on {drifted} book(s)."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from library.loans import reconcile_active_loans
+
+
+class Command(BaseCommand):
+    help = "Rebuild each user's active_loans counter from their open BorrowedBook rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many users have drifted counters.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = reconcile_active_loans(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"{drifted} user(s) have drifted loan counters.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Repaired loan counters for {drifted} user(s)."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.seeding import seed_library
+
+
+class Command(BaseCommand):
+    help = "Generate a realistic catalog, users and loan history for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--loans', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if min(options['books'], options['users'], options['loans']) < 0:
+            raise CommandError("--books, --users and --loans cannot be negative.")
+
+        def on_batch(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stats.books} books, {stats.users} users, {stats.loans} loans")
+
+        stats = seed_library(
+            books=options['books'], users=options['users'], loans=options['loans'],
+            batch_size=options['batch_size'], seed=options['seed'], on_batch=on_batch,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {stats.books} book(s), {stats.users} user(s) and {stats.loans} loan(s), "
+            f"{stats.open_loans} still open."
+        ))
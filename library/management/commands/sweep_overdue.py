@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.models import CustomUser
+from library.overdue import sweep_overdue
+
+
+class Command(BaseCommand):
+    help = "Flag overdue loans and update their fines in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--top', type=int, default=10, help="How many users with the most overdue loans to list.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        stats = sweep_overdue(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats.processed} overdue loan(s), {stats.flagged} newly flagged, "
+            f"{stats.fines} in outstanding fines across {len(stats.per_user)} user(s)."
+        ))
+
+        top = stats.per_user.most_common(options['top'])
+        names = dict(CustomUser.objects.filter(id__in=[user_id for user_id, _ in top]).values_list('id', 'username'))
+        for user_id, count in top:
+            self.stdout.write(f"  {names.get(user_id, user_id)}: {count}")
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from library.catalog_cache import bump_catalog_version
+from library.routers import replica_alias, replicate
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database to the read replica (a local stand-in for replication)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep copying every INTERVAL seconds instead of once.",
+        )
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if not alias:
+            raise CommandError("No read replica is configured (set DJANGO_REPLICA_NAME).")
+        primary = connections['default'].settings_dict
+        replica = connections[alias].settings_dict
+        if primary['ENGINE'] != replica['ENGINE'] or 'sqlite' not in primary['ENGINE']:
+            raise CommandError("sync_replica only copies SQLite databases.")
+
+        while True:
+            started = time.monotonic()
+            replicate(str(primary['NAME']), str(replica['NAME']))
+            # Fragments cached from the lagging replica under the current
+            # version may be stale; move to a new version (shared caches only).
+            bump_catalog_version()
+            self.stdout.write(f"Replica synced in {time.monotonic() - started:.3f}s.")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,186 @@
+# library/metrics.py
+"""
+Per-view request metrics, served in Prometheus text format at /metrics/.
+
+MetricsMiddleware (library.middleware) opens a RequestStats for each
+request. SQL is timed by query_timer, which sits on every database
+connection as it opens (the hook connection.execute_wrapper() uses), so
+it also sees queries the async ORM runs in worker threads. Template
+rendering is timed by the TimedDjangoTemplates backend. The totals go out
+in the response's Server-Timing header and into in-process histograms.
+Each process keeps its own histograms.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+from .throttle import counters
+
+slow_query_logger = logging.getLogger('library.slow_queries')
+
+_current = ContextVar('library_request_stats', default=None)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        return (
+            f'app;dur={total * 1000:.1f}, '
+            f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.queries} queries", '
+            f'tpl;dur={self.template_seconds * 1000:.1f}'
+        )
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def set_view(name):
+    stats = _current.get()
+    if stats is not None:
+        stats.view = name
+
+
+def query_timer(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.queries += 1
+        stats.sql_seconds += duration
+        threshold = getattr(settings, 'LIBRARY_SLOW_QUERY_MS', None)
+        if threshold is not None and duration * 1000 >= threshold:
+            slow_query_logger.warning(
+                "Slow query (%.1f ms) in %s: %s", duration * 1000, stats.view or '-', sql,
+            )
+
+
+def install_query_timer(sender, connection, **kwargs):
+    # connection_created receiver (see LibraryConfig.ready)
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class TimedTemplate:
+    """A Django backend template that adds its render time to the request's stats."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend with per-request render timing."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # view -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, view, value):
+        counts = self.series.get(view)
+        if counts is None:
+            counts = self.series[view] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for view, counts in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{view="{view}"}} {counts[-1]:.6f}')
+            lines.append(f'{self.name}_count{{view="{view}"}} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = [
+            Histogram('library_request_duration_seconds', "Time to produce the response.", SECONDS_BUCKETS),
+            Histogram('library_request_queries', "SQL queries per request.", QUERY_BUCKETS),
+            Histogram('library_request_sql_seconds', "Total SQL time per request.", SECONDS_BUCKETS),
+            Histogram('library_request_template_seconds', "Template render time per request.", SECONDS_BUCKETS),
+        ]
+
+    def record(self, stats, total):
+        values = (total, stats.queries, stats.sql_seconds, stats.template_seconds)
+        with self.lock:
+            for histogram, value in zip(self.histograms, values):
+                histogram.observe(stats.view, value)
+
+    def render(self, extra=()):
+        with self.lock:
+            lines = [line for histogram in self.histograms for line in histogram.render()]
+        return '\n'.join([*lines, *extra]) + '\n'
+
+    def reset(self):
+        with self.lock:
+            for histogram in self.histograms:
+                histogram.series.clear()
+
+
+registry = Registry()
+
+
+def render_metrics():
+    attempts = counters()
+    extra = [
+        '# HELP library_login_attempts_total Login attempts, by throttle outcome.',
+        '# TYPE library_login_attempts_total counter',
+        f'library_login_attempts_total{{outcome="processed"}} {attempts["processed"]}',
+        f'library_login_attempts_total{{outcome="rejected"}} {attempts["rejected"]}',
+    ]
+    return registry.render(extra)
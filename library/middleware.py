@@ -0,0 +1,100 @@
+# library/middleware.py
+
+import json
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+
+from . import metrics
+
+
+def _fingerprint(session_key, data):
+    return session_key, json.dumps(data, sort_keys=True, default=str)
+
+
+class _RememberLoaded:
+    """SessionStore mixin that remembers what the session held when it was loaded."""
+
+    def load(self):
+        data = super().load()
+        self._loaded_fingerprint = _fingerprint(self.session_key, data)
+        return data
+
+    async def aload(self):
+        # The db and cached_db stores do not go through load() here, and
+        # request.auser() in the async views loads the session this way
+        data = await super().aload()
+        self._loaded_fingerprint = _fingerprint(self.session_key, data)
+        return data
+
+
+class LowWriteSessionMiddleware(SessionMiddleware):
+    """SessionMiddleware that skips saving sessions whose data did not change.
+
+    Django saves (an UPDATE of django_session, or a new signed cookie)
+    whenever ``session.modified`` is set, even when a view only wrote back
+    the values that were already there. The session is compared with what
+    was loaded and left alone if nothing, including its key, changed.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.SessionStore = type('SessionStore', (_RememberLoaded, self.SessionStore), {})
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if (
+            session is not None
+            and session.modified
+            and not settings.SESSION_SAVE_EVERY_REQUEST
+            and getattr(session, '_loaded_fingerprint', None) == _fingerprint(session.session_key, session._session)
+        ):
+            session.modified = False
+        return super().process_response(request, response)
+
+
+class MetricsMiddleware:
+    """Time each request, its SQL and its templates, per view (see library.metrics).
+
+    Adds a Server-Timing header and feeds the /metrics/ histograms. Put it
+    first in MIDDLEWARE so the latency covers the whole stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, stats)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Known from here on, so slow queries can be logged against it
+        metrics.set_view(request.resolver_match.view_name)
+
+    def finish(self, request, response, stats):
+        if stats.view is None:
+            stats.view = '<unresolved>'
+        total = stats.elapsed
+        metrics.registry.record(stats, total)
+        response['Server-Timing'] = stats.server_timing(total)
+        return response
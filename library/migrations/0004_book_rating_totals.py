@@ -0,0 +1,54 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:04
+
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast
+
+
+def backfill_rating_totals(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    for model_name in ('Review', 'BorrowedBook'):
+        model = apps.get_model('library', model_name)
+        totals = (
+            model.objects.filter(rating__isnull=False)
+            .values('book')
+            .annotate(total=Sum('rating'), count=Count('rating'))
+        )
+        for row in totals:
+            Book.objects.filter(id=row['book']).update(
+                rating_sum=F('rating_sum') + row['total'],
+                rating_count=F('rating_count') + row['count'],
+            )
+    Book.objects.filter(rating_count__gt=0).update(
+        rating_avg=Cast(F('rating_sum'), FloatField()) / F('rating_count'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_book_title_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_avg',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['rating_avg', 'id'], name='book_rating_avg_id_idx'),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_active_loans(apps, schema_editor):
+    CustomUser = apps.get_model('library', 'CustomUser')
+    BorrowedBook = apps.get_model('library', 'BorrowedBook')
+    open_loans = (
+        BorrowedBook.objects.filter(returned_at__isnull=True)
+        .values('user')
+        .annotate(total=Count('id'))
+    )
+    for row in open_loans:
+        CustomUser.objects.filter(id=row['user']).update(active_loans=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_book_rating_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_active_loans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_customuser_active_loans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowedbook',
+            name='fine',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='borrowedbook',
+            name='flagged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='borrowedbook',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['due_date'], name='loan_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowedbook',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['user', 'due_date'], name='loan_user_open_due_idx'),
+        ),
+    ]
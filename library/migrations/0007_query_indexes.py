@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:12
+
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, Min, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def drop_duplicate_reviews(apps, schema_editor):
+    """Keep each user's first review of a book so the unique constraint can be added."""
+    Book = apps.get_model('library', 'Book')
+    Review = apps.get_model('library', 'Review')
+    duplicated = (
+        Review.objects.values('user', 'book')
+        .annotate(first_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for group in duplicated:
+        extra = Review.objects.filter(user=group['user'], book=group['book']).exclude(id=group['first_id'])
+        removed = list(extra.values_list('rating', flat=True))
+        extra.delete()
+        # Historical models send no signals, so take the ratings off the totals here
+        new_sum = F('rating_sum') - sum(removed)
+        new_count = F('rating_count') - len(removed)
+        Book.objects.filter(id=group['book']).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating_avg=Coalesce(Cast(new_sum, FloatField()) / NullIf(new_count, 0), Value(0.0)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('library', '0006_loan_overdue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['status'], name='book_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['genre'], name='book_genre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author'], name='book_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['role', 'username'], name='user_role_username_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='review_one_per_user_book'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookNeighbour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbours', to='library.book')),
+                ('neighbour', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-score'], name='neighbour_book_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'neighbour'), name='neighbour_book_neighbour_uniq')],
+            },
+        ),
+    ]
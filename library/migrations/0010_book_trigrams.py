@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:51
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# Frozen copies of library.typeahead.normalize and library.fuzzy.trigrams as
+# they were when this migration was written.
+def normalize(text):
+    if not text.isascii():
+        text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+def trigrams(*texts):
+    grams = set()
+    for text in texts:
+        for word in normalize(text or '').split():
+            padded = f'  {word} '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def index_existing_books(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookTrigram = apps.get_model('library', 'BookTrigram')
+    rows = []
+    for book in Book.objects.only('id', 'title', 'author', 'genre').iterator(chunk_size=2000):
+        grams = trigrams(book.title, book.author, book.genre)
+        rows.extend(BookTrigram(book_id=book.id, trigram=gram, total=len(grams)) for gram in grams)
+        if len(rows) >= 5000:
+            BookTrigram.objects.bulk_create(rows)
+            rows = []
+    BookTrigram.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_book_neighbours'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('total', models.PositiveSmallIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trigram', 'book'], name='trigram_trigram_book_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'trigram'), name='trigram_book_trigram_uniq')],
+            },
+        ),
+        migrations.RunPython(index_existing_books, migrations.RunPython.noop),
+    ]
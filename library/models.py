@@ -1,6 +1,6 @@
 # library/models.py
 
-from datetime import timezone
+from django.utils import timezone # type: ignore
 from django.contrib.auth.models import AbstractUser # type: ignore
 from django.db import models # type: ignore
 from django.contrib.auth import get_user_model # type: ignore
@@ -14,6 +14,15 @@ class CustomUser(AbstractUser):
         ('super_admin', 'Super Admin'),
     ]
     role = models.CharField(max_length=50, choices=ROLE_CHOICES, default='student')
+    # Number of loans not yet returned, maintained by library.loans in the same
+    # transaction as each borrow/return; `manage.py reconcile_loans` rebuilds it.
+    active_loans = models.PositiveIntegerField(default=0)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # User admin pages and manage_admins filter by role, listed by username
+            models.Index(fields=['role', 'username'], name='user_role_username_idx'),
+        ]
  
 
     def __str__(self):
@@ -25,19 +34,46 @@ class Book(models.Model):
     author = models.CharField(max_length=255)
     genre = models.CharField(max_length=100)
     status = models.CharField(max_length=50, choices=[('available', 'Available'), ('borrowed', 'Borrowed')], default='available')
+    # Running totals over Review.rating and BorrowedBook.rating, kept up to
+    # date by library.signals and repaired by `manage.py recompute_ratings`.
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_avg = models.FloatField(default=0.0)
+    # Bumped on every change, including the queryset update()s in
+    # library.loans and library.ratings; the JSON API's validators use it.
+    updated_at = models.DateTimeField(auto_now=True)
    
     STATUS_CHOICES = [
         ('available', 'Available'),
         ('borrowed', 'Borrowed')
     ]
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of catalog listings seeks on (title, id)
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            # ... and top-rated listings on (rating_avg, id), scanned backwards
+            models.Index(fields=['rating_avg', 'id'], name='book_rating_avg_id_idx'),
+            # The exact ?status= and ?genre= filters, and the GROUP BY of
+            # each facet (library.facets). ?author= is a substring match, so
+            # book_author_idx only serves the author facet's GROUP BY.
+            models.Index(fields=['status'], name='book_status_idx'),
+            models.Index(fields=['genre'], name='book_genre_idx'),
+            models.Index(fields=['author'], name='book_author_idx'),
+            # max(updated_at) for the JSON API's ETag / Last-Modified
+            models.Index(fields=['updated_at'], name='book_updated_at_idx'),
+        ]
+
     def get_average_rating(self):
-        # Calculate the average rating for the book
-        reviews = self.reviews.all()
-        if reviews:
-            return reviews.aggregate(Avg('rating'))['rating__avg'] # type: ignore
+        # Average of all review and loan ratings, read from the stored totals
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return None
 
+    @property
+    def average_rating(self):
+        return self.get_average_rating()
+
     def __str__(self):
         return self.title
 class Review(models.Model):
@@ -47,11 +83,26 @@ class Review(models.Model):
     review_text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One review per user per book; also the index submit_review looks up
+            models.UniqueConstraint(fields=['user', 'book'], name='review_one_per_user_book'),
+        ]
+
     def __str__(self):
         return f"Review of {self.book.title} by {self.user.username}"
     
    
 
+class LoanQuerySet(models.QuerySet):
+    def open(self):
+        return self.filter(returned_at__isnull=True)
+
+    def overdue(self, now=None):
+        """Open loans past their due date, answered from the open-loan due_date index."""
+        return self.filter(returned_at__isnull=True, due_date__lt=now or timezone.now())
+
+
 # Assuming you already have a CustomUser model and Book model
 class BorrowedBook(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -60,6 +111,20 @@ class BorrowedBook(models.Model):
     due_date = models.DateTimeField()
     returned_at = models.DateTimeField(null=True, blank=True)
     rating = models.IntegerField(null=True, blank=True)  # Add rating field
+    # Set by `manage.py sweep_overdue`: when the loan was first seen overdue
+    # and the fine accrued so far.
+    flagged_at = models.DateTimeField(null=True, blank=True)
+    fine = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+
+    objects = LoanQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Partial indexes over open loans only: returned loans (the bulk
+            # of the table over time) never enter them.
+            models.Index(fields=['due_date'], condition=models.Q(returned_at__isnull=True), name='loan_open_due_idx'),
+            models.Index(fields=['user', 'due_date'], condition=models.Q(returned_at__isnull=True), name='loan_user_open_due_idx'),
+        ]
 
     def __str__(self):
         return f"{self.book.title} borrowed by {self.user.username}"
@@ -68,5 +133,59 @@ class BorrowedBook(models.Model):
         return self.returned_at is None and self.due_date < timezone.now()
 
 
+class BookNeighbour(models.Model):
+    """One of a book's top "borrowers of this also borrowed" books.
+
+    Written by library.recommendations; ``score`` is the cosine similarity
+    of the two books' borrower columns.
+    """
+    book = models.ForeignKey(Book, related_name='neighbours', on_delete=models.CASCADE)
+    neighbour = models.ForeignKey(Book, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the index recommendation lookups seek on by book
+            models.UniqueConstraint(fields=['book', 'neighbour'], name='neighbour_book_neighbour_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['book', '-score'], name='neighbour_book_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.neighbour_id} for {self.book_id} ({self.score:.3f})"
+
+
+class NeighbourRefresh(models.Model):
+    """A new loan or rating whose neighbour rows have not been recomputed yet.
+
+    Queued in the same transaction as the loan or review and drained by
+    library.recommendations.refresh_pending() (``manage.py
+    build_recommendations --pending``), so borrowing never waits on it.
+    """
+    user = models.ForeignKey(CustomUser, related_name='+', on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, related_name='+', on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.book_id} for {self.user_id}"
+
+
+class BookTrigram(models.Model):
+    """One trigram of a book's title, author and genre, for typo-tolerant search.
 
+    Maintained by library.fuzzy; ``total`` is the book's number of distinct
+    trigrams, repeated on each row so scoring needs no second table.
+    """
+    book = models.ForeignKey(Book, related_name='+', on_delete=models.CASCADE)
+    trigram = models.CharField(max_length=3)
+    total = models.PositiveSmallIntegerField()
 
+    class Meta:
+        constraints = [
+            # Also the index a candidate's shared trigrams are counted on
+            models.UniqueConstraint(fields=['book', 'trigram'], name='trigram_book_trigram_uniq'),
+        ]
+        indexes = [
+            # Candidate lookup: the posting list of each query trigram
+            models.Index(fields=['trigram', 'book'], name='trigram_trigram_book_idx'),
+        ]
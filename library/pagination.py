@@ -0,0 +1,162 @@
+# library/pagination.py
+
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Return the key values stored in ``cursor``, or None if it is unusable."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _field(entry):
+    return entry.lstrip('-')
+
+
+def after_q(ordering, values):
+    """Rows that sort strictly after ``values`` in ``ordering``.
+
+    Entries prefixed with ``-`` sort descending. The leading range on the
+    first column is redundant logically but gives the database a bound it
+    can seek to in the index instead of scanning from the first row.
+    """
+    def op(entry, strict):
+        if entry.startswith('-'):
+            return 'lt' if strict else 'lte'
+        return 'gt' if strict else 'gte'
+
+    q = Q()
+    for i, entry in enumerate(ordering):
+        term = Q(**{f'{_field(entry)}__{op(entry, True)}': values[i]})
+        for prev_entry, prev_value in zip(ordering[:i], values[:i]):
+            term &= Q(**{_field(prev_entry): prev_value})
+        q |= term
+    first = ordering[0]
+    return Q(**{f'{_field(first)}__{op(first, False)}': values[0]}) & q
+
+
+def get_page_size(request):
+    default = getattr(settings, 'LIBRARY_PAGE_SIZE', 25)
+    maximum = getattr(settings, 'LIBRARY_MAX_PAGE_SIZE', 100)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+class KeysetPage:
+    """One page of a keyset-paginated listing.
+
+    Iterates like the list of rows it holds, so templates can keep looping
+    over it with ``{% for %}`` / ``{% empty %}``. The query only runs when
+    the rows are first needed, so a template that serves the page from a
+    cached fragment never touches the database.
+    """
+
+    def __init__(self, request, queryset, ordering, page_size, is_first):
+        self.request = request
+        self.queryset = queryset
+        self.ordering = ordering
+        self.page_size = page_size
+        self.is_first = is_first
+        self._rows = None
+
+    def _fetch(self):
+        if self._rows is None:
+            self._rows = list(self.queryset[:self.page_size + 1])
+        return self._rows
+
+    async def afetch(self):
+        """Load the page with the async ORM, for async views.
+
+        Call it before rendering: the lazy fetch above is synchronous and
+        may not run on the event loop.
+        """
+        if self._rows is None:
+            self._rows = [row async for row in self.queryset[:self.page_size + 1]]
+        return self._rows
+
+    @property
+    def object_list(self):
+        return self._fetch()[:self.page_size]
+
+    @property
+    def has_next(self):
+        return len(self._fetch()) > self.page_size
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor([getattr(last, _field(entry)) for entry in self.ordering])
+
+    def _query_string(self, cursor):
+        params = self.request.GET.copy()
+        params.pop('after', None)
+        if cursor:
+            params['after'] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query_string(self.next_cursor)
+
+    @property
+    def first_query(self):
+        return self._query_string(None)
+
+
+def paginate(request, queryset, ordering=('id',)):
+    """Return the page of ``queryset`` that follows the ``?after=`` cursor.
+
+    ``ordering`` must end in a unique column so every row has a distinct
+    key. Each page is one ``LIMIT page_size + 1`` query seeking from the
+    cursor, so deep pages cost the same as the first one (no OFFSET). The
+    query is deferred until the page is read.
+    Unreadable cursors start again from the first page.
+    """
+    ordering = tuple(ordering)
+    page_size = get_page_size(request)
+    queryset = queryset.order_by(*ordering)
+
+    values = None
+    cursor = request.GET.get('after')
+    if cursor:
+        values = decode_cursor(cursor, len(ordering))
+    if values is not None:
+        try:
+            queryset = queryset.filter(after_q(ordering, values))
+        except (TypeError, ValueError, ValidationError):
+            # Decodable but the wrong types for the ordering, e.g. null or a
+            # string for an id: the lookups reject it while the filter is built
+            values = None
+
+    return KeysetPage(request, queryset, ordering, page_size, values is None)
@@ -0,0 +1,71 @@
+# library/ratings.py
+
+from django.db.models import F, FloatField, IntegerField, OuterRef, Subquery, Sum, Count, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+
+from .catalog_cache import invalidate_catalog
+from .models import Book, BorrowedBook, Review
+
+
+def _average(total, count):
+    return Coalesce(Cast(total, FloatField()) / NullIf(count, 0), Value(0.0))
+
+
+def apply_rating_change(book_id, old_rating, new_rating):
+    """Fold one rating being added, changed or removed into the book's totals.
+
+    ``old_rating``/``new_rating`` are None when there was / will be no
+    rating. The row is updated with F() expressions in a single UPDATE, so
+    concurrent raters never overwrite each other's contribution.
+    """
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    if not sum_delta and not count_delta:
+        return
+    new_sum = F('rating_sum') + sum_delta
+    new_count = F('rating_count') + count_delta
+    Book.objects.filter(id=book_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        rating_avg=_average(new_sum, new_count),
+        updated_at=timezone.now(),
+    )
+    invalidate_catalog()
+
+
+def _rating_totals(model, aggregate):
+    rows = (
+        model.objects.filter(book=OuterRef('pk'), rating__isnull=False)
+        .order_by()
+        .values('book')
+        .annotate(total=aggregate('rating'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def recompute_ratings(queryset=None, dry_run=False):
+    """Recompute stored rating totals from Review and BorrowedBook ratings.
+
+    Only books whose stored values disagree with the source rows are
+    rewritten, in one UPDATE. Returns the number of drifted books.
+    """
+    queryset = Book.objects.all() if queryset is None else queryset
+    expected_sum = _rating_totals(Review, Sum) + _rating_totals(BorrowedBook, Sum)
+    expected_count = _rating_totals(Review, Count) + _rating_totals(BorrowedBook, Count)
+    drifted = queryset.annotate(
+        expected_sum=expected_sum,
+        expected_count=expected_count,
+    ).exclude(rating_sum=F('expected_sum'), rating_count=F('expected_count'))
+
+    drifted_count = drifted.count()
+    if drifted_count and not dry_run:
+        Book.objects.filter(pk__in=drifted.values('pk')).update(
+            rating_sum=expected_sum,
+            rating_count=expected_count,
+            rating_avg=_average(expected_sum, expected_count),
+            updated_at=timezone.now(),
+        )
+        invalidate_catalog()
+    return drifted_count
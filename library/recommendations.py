@@ -0,0 +1,184 @@
+# library/recommendations.py
+"""
+"Borrowers of this also borrowed" recommendations.
+
+Loans form a sparse user x book matrix: an entry is 1 for a book the user
+borrowed, or rating / 3 once they rated it (a review's rating wins over
+loan ratings), so a 5-star read pulls harder than a 1-star one. Two books
+are as similar as the cosine of their columns. The TOP_K most similar
+books of each book are stored as BookNeighbour rows.
+
+rebuild_neighbours() recomputes every row, with NumPy/SciPy sparse
+products when they are installed and plain dictionaries otherwise.
+New loans and ratings only queue a NeighbourRefresh row (library.signals,
+library.loans.borrow_many); refresh_pending(), run periodically by
+``manage.py build_recommendations --pending``, recomputes just the rows
+the queued ones touch, all in one pass.
+"""
+
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max, Sum
+
+from .importer import batched
+from .models import BookNeighbour, BorrowedBook, NeighbourRefresh, Review
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # optional: the pure-Python path gives the same scores
+    numpy = sparse = None
+
+TOP_K = 10
+NEUTRAL_RATING = 3
+
+
+def _entries(book_ids=None):
+    """Matrix entries {(user_id, book_id): weight}, for all books or the columns of ``book_ids``."""
+    loans = BorrowedBook.objects.order_by().values('user_id', 'book_id').annotate(rating=Max('rating'))
+    reviews = Review.objects.values_list('user_id', 'book_id', 'rating')
+    if book_ids is not None:
+        loans, reviews = loans.filter(book__in=book_ids), reviews.filter(book__in=book_ids)
+    entries = {
+        (loan['user_id'], loan['book_id']): (loan['rating'] or NEUTRAL_RATING) / NEUTRAL_RATING
+        for loan in loans.iterator()
+    }
+    for user_id, book_id, rating in reviews.iterator():
+        if (user_id, book_id) in entries:
+            entries[user_id, book_id] = rating / NEUTRAL_RATING
+    return entries
+
+
+def _top(scores, k):
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def _neighbours_python(entries, rows, k):
+    """{book_id: [(neighbour_id, score), ...]} for each book in ``rows``.
+
+    ``entries`` must hold the full column of every book that shares a
+    borrower with a book in ``rows``, or the norms come out wrong.
+    """
+    by_user = defaultdict(list)
+    norms = defaultdict(float)
+    for (user_id, book_id), weight in entries.items():
+        by_user[user_id].append((book_id, weight))
+        norms[book_id] += weight * weight
+    dots = defaultdict(lambda: defaultdict(float))
+    for books in by_user.values():
+        for book_id, weight in books:
+            if book_id not in rows:
+                continue
+            row = dots[book_id]
+            for other_id, other_weight in books:
+                if other_id != book_id:
+                    row[other_id] += weight * other_weight
+    return {
+        book_id: _top(
+            {other_id: dot / math.sqrt(norms[book_id] * norms[other_id]) for other_id, dot in dots[book_id].items()},
+            k,
+        )
+        for book_id in rows
+    }
+
+
+def _neighbours_vectorized(entries, rows, k):
+    """Same as _neighbours_python, as sparse matrix products; ``rows`` None means every book."""
+    keys = numpy.array(list(entries), dtype=numpy.int64).reshape(-1, 2)
+    weights = numpy.fromiter(entries.values(), dtype=numpy.float64, count=len(entries))
+    user_ids, users = numpy.unique(keys[:, 0], return_inverse=True)
+    book_ids, books = numpy.unique(keys[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix((weights, (users, books)), shape=(len(user_ids), len(book_ids)))
+
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    matrix = (matrix @ sparse.diags(1 / norms)).tocsc()
+    wanted = book_ids.tolist() if rows is None else sorted(set(rows) & set(book_ids.tolist()))
+    similarity = (matrix[:, numpy.searchsorted(book_ids, wanted)].T @ matrix).tocsr()
+
+    neighbours = dict.fromkeys(rows or (), [])
+    for row, book_id in enumerate(wanted):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        scores = dict(zip(book_ids[similarity.indices[start:end]].tolist(), similarity.data[start:end].tolist()))
+        scores.pop(book_id, None)
+        neighbours[book_id] = _top(scores, k)
+    return neighbours
+
+
+def _insert(neighbours, batch_size=5000):
+    rows = (
+        BookNeighbour(book_id=book_id, neighbour_id=neighbour_id, score=score)
+        for book_id, top in neighbours.items()
+        for neighbour_id, score in top
+    )
+    for batch in batched(rows, batch_size):
+        BookNeighbour.objects.bulk_create(batch)
+
+
+def rebuild_neighbours(k=TOP_K, vectorized=None):
+    """Recompute every book's neighbours from scratch. Returns the number of books with loans.
+
+    ``vectorized`` defaults to whether NumPy and SciPy are importable.
+    """
+    if vectorized is None:
+        vectorized = sparse is not None
+    # Everything queued so far is covered by the loans read below
+    queued = NeighbourRefresh.objects.aggregate(last=Max('id'))['last']
+    entries = _entries()
+    if vectorized and entries:
+        neighbours = _neighbours_vectorized(entries, None, k)
+    else:
+        neighbours = _neighbours_python(entries, {book_id for _, book_id in entries}, k)
+    with transaction.atomic():
+        BookNeighbour.objects.all().delete()
+        _insert(neighbours)
+        if queued is not None:
+            NeighbourRefresh.objects.filter(id__lte=queued).delete()
+    return len(neighbours)
+
+
+def refresh_pending(k=TOP_K, vectorized=None):
+    """Recompute the rows the queued NeighbourRefresh entries change. Returns the number of rows.
+
+    For each queued (user, book) those are the book's own row and the rows
+    of the other books in the user's history, whose similarity to it moved.
+    Only the columns of books that share a borrower with them are read.
+    Other rows that list the books keep a slightly stale score until the
+    next rebuild.
+    """
+    if vectorized is None:
+        vectorized = sparse is not None
+    queued = list(NeighbourRefresh.objects.values_list('id', 'user_id', 'book_id'))
+    if not queued:
+        return 0
+    rows = {book_id for _, _, book_id in queued}
+    users = {user_id for _, user_id, _ in queued}
+    rows.update(BorrowedBook.objects.filter(user__in=users).values_list('book_id', flat=True).distinct())
+    borrowers = BorrowedBook.objects.filter(book__in=rows).values('user_id')
+    entries = _entries(BorrowedBook.objects.filter(user__in=borrowers).values('book_id'))
+    if vectorized and entries:
+        neighbours = _neighbours_vectorized(entries, rows, k)
+    else:
+        neighbours = _neighbours_python(entries, rows, k)
+    with transaction.atomic():
+        BookNeighbour.objects.filter(book__in=rows).delete()
+        _insert(neighbours)
+        # Entries queued since the read above wait for the next run
+        NeighbourRefresh.objects.filter(id__lte=max(entry_id for entry_id, _, _ in queued)).delete()
+    return len(rows)
+
+
+def recommended_for(user, limit=5):
+    """Books the user has not borrowed, ranked by summed similarity to those they have.
+
+    A single query over the neighbour table's (book, neighbour) index.
+    """
+    mine = BorrowedBook.objects.filter(user=user).values('book_id')
+    return (
+        BookNeighbour.objects.filter(book__in=mine)
+        .exclude(neighbour__in=mine)
+        .values('neighbour_id', 'neighbour__title', 'neighbour__author')
+        .annotate(score=Sum('score'))
+        .order_by('-score', 'neighbour_id')[:limit]
+    )
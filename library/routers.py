@@ -0,0 +1,87 @@
+# library/routers.py
+
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Set while a read-only view runs (see decorators.read_replica). Context
+# variables follow the request through threads and async tasks alike.
+_reading_replica = ContextVar('library_reading_replica', default=False)
+
+PIN_KEY = 'library:pin_primary:{}'
+
+
+def replica_alias():
+    """The configured read replica alias, or None when there is no replica."""
+    return getattr(settings, 'LIBRARY_READ_REPLICA', None)
+
+
+@contextmanager
+def reading_from_replica():
+    token = _reading_replica.set(True)
+    try:
+        yield
+    finally:
+        _reading_replica.reset(token)
+
+
+def pin_to_primary(user_id):
+    """Send ``user_id``'s reads to the primary for a while after they write.
+
+    The replica may lag behind; without this a student who just borrowed a
+    book could see it listed as available again on the next page.
+    """
+    seconds = getattr(settings, 'LIBRARY_REPLICA_PIN_SECONDS', 10)
+    if replica_alias() and seconds:
+        cache.set(PIN_KEY.format(user_id), True, timeout=seconds)
+
+
+def is_pinned(user_id):
+    return bool(replica_alias()) and cache.get(PIN_KEY.format(user_id), False)
+
+
+async def ais_pinned(user_id):
+    return bool(replica_alias()) and await cache.aget(PIN_KEY.format(user_id), False)
+
+
+class PrimaryReplicaRouter:
+    """Reads of library models inside read-only views go to the replica.
+
+    Everything else - all writes, reads made by write paths, and other apps
+    such as sessions and auth - stays on ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        if alias and _reading_replica.get() and model._meta.app_label == 'library':
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of default, so objects from either may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from replication, not from migrate
+        return db != replica_alias()
+
+
+def replicate(source_path, replica_path):
+    """Copy the primary SQLite file to the replica as one consistent snapshot.
+
+    A stand-in for real replication when developing: it uses SQLite's online
+    backup API, so it is safe while the primary is taking writes.
+    """
+    source = sqlite3.connect(source_path)
+    replica = sqlite3.connect(replica_path)
+    try:
+        source.backup(replica)
+    finally:
+        replica.close()
+        source.close()
@@ -0,0 +1,194 @@
+# library/search.py
+
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connection, connections, OperationalError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .fuzzy import fuzzy_match
+
+# FTS5 shadow table holding title/author/genre for every Book. It is an
+# external-content table (the text lives in library_book) kept in sync by
+# triggers created in migration 0002, so every write path - forms, admin,
+# bulk_create, raw updates - stays indexed.
+FTS_TABLE = 'library_book_fts'
+
+# bm25 column weights: a hit in the title counts more than author, author
+# more than genre.
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Keyset ordering for ranked results; id makes the key unique.
+RANKED_ORDERING = ('search_rank', 'id')
+
+# Fewer exact hits than this and close matches from the fuzzy search are
+# listed after them
+FUZZY_MIN_HITS = 3
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author, genre,
+        content='library_book', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS library_book_fts_ai AFTER INSERT ON library_book BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author, genre)
+        VALUES (new.id, new.title, new.author, new.genre);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS library_book_fts_ad AFTER DELETE ON library_book BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, genre)
+        VALUES ('delete', old.id, old.title, old.author, old.genre);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS library_book_fts_au AFTER UPDATE OF title, author, genre ON library_book BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, genre)
+        VALUES ('delete', old.id, old.title, old.author, old.genre);
+        INSERT INTO {FTS_TABLE}(rowid, title, author, genre)
+        VALUES (new.id, new.title, new.author, new.genre);
+    END""",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS library_book_fts_au',
+    'DROP TRIGGER IF EXISTS library_book_fts_ad',
+    'DROP TRIGGER IF EXISTS library_book_fts_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def create_index(conn):
+    """Create the FTS table and triggers and index the existing catalog.
+
+    Safe to call repeatedly: it only does work when something is missing.
+    SQLite migrations that alter Book rebuild library_book from scratch and
+    drop its triggers on the way, so this also runs after every migrate
+    (see LibraryConfig.ready).
+
+    Returns False when the backend is not SQLite or SQLite was built
+    without FTS5; searches then fall back to icontains.
+    """
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name = %s OR name LIKE 'library_book_fts_a_'",
+            [FTS_TABLE],
+        )
+        if cursor.fetchone()[0] == len(CREATE_SQL):
+            return True
+    try:
+        with conn.cursor() as cursor:
+            for sql in CREATE_SQL:
+                cursor.execute(sql)
+    except OperationalError:
+        return False
+    rebuild_index(conn)
+    conn._library_fts_enabled = True
+    return True
+
+
+def drop_index(conn):
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for sql in DROP_SQL:
+            cursor.execute(sql)
+
+
+def rebuild_index(conn=None):
+    """Re-read every row of library_book into the FTS table."""
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def fts_enabled(using='default'):
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return False
+    # Remembered per connection so searches don't pay for the lookup.
+    enabled = getattr(conn, '_library_fts_enabled', None)
+    if enabled is None:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [FTS_TABLE],
+            )
+            enabled = cursor.fetchone() is not None
+        conn._library_fts_enabled = enabled
+    return enabled
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word must match (implicit AND) and the last characters typed may
+    be the start of a longer word, so "harr pot" finds "Harry Potter".
+    Words are quoted so user input can never inject FTS5 operators.
+    """
+    tokens = TOKEN_RE.findall(text)
+    return ' '.join('"%s"*' % token for token in tokens)
+
+
+def search_books(queryset, text):
+    """Filter ``queryset`` down to books matching ``text``, best match first.
+
+    When the exact search finds fewer than FUZZY_MIN_HITS books, typos are
+    assumed: the trigram search (library.fuzzy) adds close matches, ranked
+    after the exact hits.
+    """
+    text = text.strip()
+    if not text:
+        return queryset
+    return _search(queryset, text)
+
+
+async def asearch_books(queryset, text):
+    """search_books() for async views: the lookups run off the event loop."""
+    text = text.strip()
+    if not text:
+        return queryset
+    return await sync_to_async(_search)(queryset, text)
+
+
+def _search(queryset, text):
+    books = _match(queryset, text, fts_enabled(queryset.db))
+    exact = list(books.values_list('id', flat=True)[:FUZZY_MIN_HITS])
+    if len(exact) < FUZZY_MIN_HITS:
+        books = fuzzy_match(queryset, text, first=exact).order_by(*RANKED_ORDERING)
+    return books
+
+
+def _match(queryset, text, fts):
+    if not fts:
+        return queryset.filter(
+            Q(title__icontains=text) |
+            Q(author__icontains=text) |
+            Q(genre__icontains=text)
+        )
+
+    match = build_match_query(text)
+    if not match:
+        return queryset.none()
+    weights = ', '.join(str(w) for w in RANK_WEIGHTS)
+    matching_ids = RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]
+    )
+    rank = RawSQL(
+        f'SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = library_book.id',
+        [match],
+    )
+    return (
+        queryset.filter(id__in=matching_ids)
+        .annotate(search_rank=rank)
+        .order_by(*RANKED_ORDERING)
+    )
+
+
+def is_ranked(queryset):
+    """True if ``queryset`` came out of an FTS search and carries a rank."""
+    return 'search_rank' in queryset.query.annotations
@@ -0,0 +1,151 @@
+# library/seeding.py
+
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .catalog_cache import invalidate_catalog
+from .fuzzy import index_books
+from .importer import batched
+from .loans import LOAN_PERIOD, MAX_OPEN_LOANS, reconcile_active_loans
+from .models import Book, BorrowedBook, CustomUser
+from .ratings import recompute_ratings
+
+WORDS = (
+    "shadow river house night garden winter secret stone city fire moon empire "
+    "silent glass storm island crown letter history children ocean forest iron "
+    "golden last lost hidden dream war road summer kingdom blood music mountain"
+).split()
+FIRST_NAMES = "Ada Ben Chidi Dawit Elena Farah Gabriel Hana Ivan Jia Kofi Lena Marta Noor Omar Priya".split()
+LAST_NAMES = "Abebe Brown Chen Diallo Evans Fischer Garcia Haile Ito Jensen Kim Lopez Mensah Novak Okafor".split()
+GENRES = ["Fiction", "Fantasy", "Science Fiction", "History", "Biography", "Poetry", "Mystery", "Romance", "Science", "Children"]
+
+
+class SeedStats:
+    def __init__(self):
+        self.books = 0
+        self.users = 0
+        self.loans = 0
+        self.open_loans = 0
+
+
+def _title(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+
+
+def _author(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _role(number):
+    # One super admin, one admin per fifty users, students otherwise
+    if number == 0:
+        return 'super_admin'
+    return 'admin' if number % 50 == 1 else 'student'
+
+
+def _created_ids(model, before):
+    """Ids of the rows bulk-inserted since the table's max id was ``before``."""
+    return range(before + 1, (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1)
+
+
+def seed_library(books=10000, users=1000, loans=20000, batch_size=5000, seed=0, on_batch=None):
+    """Fill the catalog with a realistic, reproducible data set.
+
+    Titles skew towards a few genres and popular words, about a tenth of
+    loans are still open (a share of them overdue), half of the returned
+    ones carry a rating. Rows are bulk inserted ``batch_size`` at a time,
+    then the stored rating totals and open-loan counters are rebuilt once.
+    Seeded users are named ``seed-<n>`` and cannot log in with a password;
+    students never hold more than the loan limit.
+    """
+    rng = random.Random(seed)
+    stats = SeedStats()
+    now = timezone.now()
+    genre_weights = [1 / (rank + 1) for rank in range(len(GENRES))]
+    password = make_password(None)  # unusable
+
+    last_book = Book.objects.aggregate(last=Max('id'))['last'] or 0
+    new_books = (
+        Book(title=_title(rng), author=_author(rng), genre=rng.choices(GENRES, genre_weights)[0])
+        for _ in range(books)
+    )
+    for batch in batched(new_books, batch_size):
+        with transaction.atomic():
+            Book.objects.bulk_create(batch)
+            index_books(batch)
+        stats.books += len(batch)
+        if on_batch:
+            on_batch(stats)
+    book_ids = _created_ids(Book, last_book)
+
+    last_user = CustomUser.objects.aggregate(last=Max('id'))['last'] or 0
+    offset = CustomUser.objects.filter(username__startswith='seed-').count()
+    new_users = (
+        CustomUser(
+            username=f'seed-{offset + number}', email=f'seed-{offset + number}@example.com',
+            password=password, role=_role(offset + number),
+        )
+        for number in range(users)
+    )
+    for batch in batched(new_users, batch_size):
+        with transaction.atomic():
+            CustomUser.objects.bulk_create(batch)
+        stats.users += len(batch)
+        if on_batch:
+            on_batch(stats)
+    user_ids = _created_ids(CustomUser, last_user)
+    students = list(
+        CustomUser.objects.filter(id__gte=user_ids.start, id__lt=user_ids.stop, role='student').values_list('id', flat=True)
+    )
+    if not students or not book_ids:
+        return stats
+
+    # Open loans: each on its own book, at most MAX_OPEN_LOANS per student
+    open_count = min(loans // 10, len(book_ids), len(students) * MAX_OPEN_LOANS)
+    open_books = rng.sample(book_ids, open_count)
+    rng.shuffle(students)
+
+    def new_loans():
+        for number in range(loans):
+            borrowed_at = now - timedelta(days=rng.uniform(0, 730))
+            if number < open_count:
+                # Borrowed in the last four weeks, so about half are overdue
+                borrowed_at = now - timedelta(days=rng.uniform(0, 28))
+                yield BorrowedBook(
+                    user_id=students[number % len(students)], book_id=open_books[number],
+                    due_date=borrowed_at + LOAN_PERIOD,
+                )
+            else:
+                yield BorrowedBook(
+                    user_id=rng.choice(students), book_id=rng.choice(book_ids),
+                    due_date=borrowed_at + LOAN_PERIOD,
+                    # Never in the future for loans borrowed in the last 20 days
+                    returned_at=min(borrowed_at + timedelta(days=rng.uniform(1, 20)), now),
+                    rating=rng.randint(1, 5) if rng.random() < 0.5 else None,
+                )
+
+    last_loan = BorrowedBook.objects.aggregate(last=Max('id'))['last'] or 0
+    for batch in batched(new_loans(), batch_size):
+        with transaction.atomic():
+            BorrowedBook.objects.bulk_create(batch)
+        stats.loans += len(batch)
+        if on_batch:
+            on_batch(stats)
+    stats.open_loans = open_count
+
+    # borrowed_at is auto_now_add, so bulk_create stamped every loan with
+    # the current time; move it back to match the generated due dates.
+    seeded = _created_ids(BorrowedBook, last_loan)
+    BorrowedBook.objects.filter(id__gte=seeded.start, id__lt=seeded.stop).update(borrowed_at=F('due_date') - LOAN_PERIOD)
+
+    for batch in batched(open_books, batch_size):
+        Book.objects.filter(id__in=batch).update(status='borrowed', updated_at=now)
+    reconcile_active_loans()
+    recompute_ratings()
+    invalidate_catalog()
+    return stats
@@ -0,0 +1,24 @@
+# library/sessions.py
+
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.utils import timezone
+
+
+def purge_expired_sessions(batch_size=1000, now=None):
+    """Delete expired rows from django_session, ``batch_size`` at a time.
+
+    Unlike ``manage.py clearsessions`` (one DELETE over the whole table),
+    each batch is a short transaction on the expire_date index, so logins
+    and other writers are never blocked behind a long purge. Returns the
+    number of sessions deleted.
+    """
+    now = now or timezone.now()
+    expired = Session.objects.filter(expire_date__lt=now).order_by('expire_date')
+    deleted = 0
+    while True:
+        keys = list(expired.values_list('session_key', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        with transaction.atomic():
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
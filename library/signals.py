@@ -0,0 +1,91 @@
+# library/signals.py
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .auth import forget_user
+from .catalog_cache import invalidate_catalog
+from .fuzzy import index_books
+from .models import Book, BorrowedBook, CustomUser, NeighbourRefresh, Review
+from .ratings import apply_rating_change
+from .typeahead import book_changed as typeahead_changed
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, instance, **kwargs):
+    invalidate_catalog()
+
+
+# Titles, authors and genres feed the trigram table (library.fuzzy) and
+# this process's typeahead index (library.typeahead).
+@receiver(post_init, sender=Book)
+def remember_text(sender, instance, **kwargs):
+    instance._text = tuple(instance.__dict__.get(field) for field in ('title', 'author', 'genre'))
+
+
+@receiver(post_save, sender=Book)
+def update_text_indexes(sender, instance, created, **kwargs):
+    old, new = None if created else instance._text, (instance.title, instance.author, instance.genre)
+    instance._text = new
+    if old == new:
+        return
+    index_books([instance])
+    if old is None or old[:2] != new[:2]:
+        transaction.on_commit(lambda: typeahead_changed(old and old[:2], new[:2]), robust=True)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_typeahead(sender, instance, **kwargs):
+    old = instance._text[:2]
+    transaction.on_commit(lambda: typeahead_changed(old, None), robust=True)
+
+
+# Role changes, bans, password changes and deletions must reach the cached
+# user that authenticates each request (library.auth).
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+# Review and BorrowedBook both carry a rating that counts towards the book's
+# stored totals. Remember what each instance held when it was loaded so a
+# save only applies the difference.
+
+@receiver(post_init, sender=Review)
+@receiver(post_init, sender=BorrowedBook)
+def remember_rating(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not fetched just for this
+    instance._rated = (instance.__dict__.get('book_id'), instance.__dict__.get('rating'))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=BorrowedBook)
+def update_book_rating(sender, instance, created, **kwargs):
+    old_book_id, old_rating = instance._rated
+    if created:
+        old_rating = None
+    if old_book_id != instance.book_id and old_book_id is not None:
+        apply_rating_change(old_book_id, old_rating, None)
+        old_rating = None
+    apply_rating_change(instance.book_id, old_rating, instance.rating)
+    instance._rated = (instance.book_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=BorrowedBook)
+def remove_book_rating(sender, instance, **kwargs):
+    old_book_id, old_rating = instance._rated
+    apply_rating_change(old_book_id, old_rating, None)
+
+
+# New loans and ratings move the co-borrowing scores of the books involved.
+# Only queue them: library.recommendations.refresh_pending() recomputes the
+# rows off the request path.
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=BorrowedBook)
+def update_neighbours(sender, instance, created, **kwargs):
+    if created or instance.rating is not None:
+        NeighbourRefresh.objects.create(user_id=instance.user_id, book_id=instance.book_id)
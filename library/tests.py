@@ -1,9 +1,52 @@
 from django.test import TestCase # type: ignore
 
 # Create your tests here.
-from django.test import TestCase, Client
+import asyncio
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.contrib import auth
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
 from django.urls import reverse
-from .models import Book, CustomUser
+from django.utils import timezone
+
+from library_management_system.sqlite_backend.base import DatabaseWrapper
+
+from . import benchmarks, fuzzy, loans, metrics, recommendations, throttle, typeahead, views
+from .catalog_cache import catalog_version
+from .decorators import read_replica
+from .facets import facet_queries
+from .middleware import LowWriteSessionMiddleware
+from .models import Book, BookNeighbour, BookTrigram, BorrowedBook, CustomUser, NeighbourRefresh, Review
+from .importer import import_books
+from .pagination import after_q, encode_cursor, paginate
+from .ratings import recompute_ratings
+from .routers import PrimaryReplicaRouter, is_pinned, pin_to_primary, replicate
+from .search import search_books
+from .seeding import seed_library
+from .sessions import purge_expired_sessions
 
 class BookModelTest(TestCase):
     def setUp(self):
@@ -28,7 +71,7 @@ class BookListViewTest(TestCase):
     def test_book_list_view(self):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, 'book_list.html')
+        self.assertTemplateUsed(response, 'books/book_list.html')
 
 class CustomUserModelTest(TestCase):
     def setUp(self):
@@ -42,3 +85,1361 @@ class CustomUserModelTest(TestCase):
         self.assertEqual(self.user.username, "testuser")
         self.assertTrue(self.user.check_password("testpassword"))
         self.assertEqual(self.user.role, "admin")
+
+
+class BookSearchTest(TestCase):
+    def setUp(self):
+        self.potter = Book.objects.create(title="Harry Potter", author="J. K. Rowling", genre="Fantasy")
+        self.hobbit = Book.objects.create(title="The Hobbit", author="J. R. R. Tolkien", genre="Fantasy")
+        self.dune = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+
+    def search(self, text):
+        return list(search_books(Book.objects.all(), text))
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search("harr pot"), [self.potter])
+
+    def test_title_hits_rank_above_genre_hits(self):
+        fantasy_title = Book.objects.create(title="Fantasy Atlas", author="A. Cartographer", genre="Reference")
+        self.assertEqual(self.search("fantasy")[0], fantasy_title)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.dune.title = "Children of Dune"
+        self.dune.save()
+        self.assertEqual(self.search("children"), [self.dune])
+        self.dune.delete()
+        self.assertEqual(self.search("dune"), [])
+
+    @mock.patch('library.search.FUZZY_MIN_HITS', 0)  # the FTS query alone
+    def test_operators_in_input_are_not_interpreted(self):
+        self.assertEqual(self.search('hobbit" OR "dune'), [])
+        self.assertEqual(self.search("hobbit*"), [self.hobbit])
+
+    def test_filters_still_apply_on_top_of_search(self):
+        self.hobbit.status = 'borrowed'
+        self.hobbit.save()
+        response = self.client.get(reverse('book_list'), {'search': 'j', 'status': 'available'})
+        self.assertEqual(list(response.context['books']), [self.potter])
+
+
+@override_settings(LIBRARY_PAGE_SIZE=2)
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        for title in ["Emma", "Dune", "Beloved", "Dune", "Carrie"]:
+            Book.objects.create(title=title, author="Author", genre="Fiction")
+
+    def walk(self, ordering):
+        titles, params = [], {}
+        while True:
+            page = paginate(self.factory.get('/', params), Book.objects.all(), ordering)
+            titles.extend(book.title for book in page)
+            if not page.has_next:
+                return titles
+            params = {'after': page.next_cursor}
+
+    def test_pages_cover_every_row_once_in_order(self):
+        self.assertEqual(self.walk(('title', 'id')), ["Beloved", "Carrie", "Dune", "Dune", "Emma"])
+
+    def test_page_size_is_capped(self):
+        request = self.factory.get('/', {'page_size': '1000'})
+        with self.settings(LIBRARY_MAX_PAGE_SIZE=3):
+            self.assertEqual(len(paginate(request, Book.objects.all())), 3)
+
+    def test_bad_cursor_starts_from_first_page(self):
+        page = paginate(self.factory.get('/', {'after': 'not-a-cursor'}), Book.objects.all(), ('title', 'id'))
+        self.assertTrue(page.is_first)
+        self.assertEqual(page[0].title, "Beloved")
+
+    def test_cursor_with_wrong_value_types_starts_from_first_page(self):
+        for values in (["x", "notint"], [None, None], [{}, [1]]):
+            request = self.factory.get('/', {'after': encode_cursor(values)})
+            page = paginate(request, Book.objects.all(), ('title', 'id'))
+            self.assertTrue(page.is_first)
+            self.assertEqual(page[0].title, "Beloved")
+        for values in (["x", "notint"], [None, None]):
+            response = self.client.get(reverse('api_books'), {'after': encode_cursor(values)})
+            self.assertEqual(response.status_code, 200)
+
+    def test_deep_page_does_not_use_offset(self):
+        cursor = paginate(self.factory.get('/'), Book.objects.all(), ('title', 'id')).next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            list(paginate(self.factory.get('/', {'after': cursor}), Book.objects.all(), ('title', 'id')))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+
+    def test_next_link_keeps_search_parameters(self):
+        page = paginate(self.factory.get('/', {'search': 'x', 'after': 'old'}), Book.objects.all())
+        self.assertIn('search=x', page.next_query)
+        self.assertNotIn('after=old', page.next_query)
+
+
+class BorrowReturnTest(TestCase):
+    def setUp(self):
+        self.student = CustomUser.objects.create_user(username="reader", password="pw", role="student")
+        self.other = CustomUser.objects.create_user(username="other", password="pw", role="student")
+        self.book = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+
+    def test_borrow_then_return(self):
+        loan = loans.borrow(self.student, self.book.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.status, 'borrowed')
+        loans.return_loan(self.student, loan.id)
+        self.book.refresh_from_db()
+        loan.refresh_from_db()
+        self.assertEqual(self.book.status, 'available')
+        self.assertIsNotNone(loan.returned_at)
+
+    def test_borrowed_book_is_refused(self):
+        loans.borrow(self.student, self.book.id)
+        with self.assertRaises(loans.LoanError):
+            loans.borrow(self.other, self.book.id)
+
+    def test_loan_limit_releases_the_claimed_book(self):
+        for i in range(loans.MAX_OPEN_LOANS):
+            extra = Book.objects.create(title=f"Book {i}", author="A", genre="G")
+            loans.borrow(self.student, extra.id)
+        with self.assertRaises(loans.LoanError):
+            loans.borrow(self.student, self.book.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.status, 'available')
+
+    def test_double_return_does_not_free_a_relent_copy(self):
+        loan = loans.borrow(self.student, self.book.id)
+        loans.return_loan(self.student, loan.id)
+        loans.borrow(self.other, self.book.id)
+        with self.assertRaises(loans.LoanError):
+            loans.return_loan(self.student, loan.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.status, 'borrowed')
+
+    def test_active_loans_counter_follows_borrow_and_return(self):
+        loan = loans.borrow(self.student, self.book.id)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.active_loans, 1)
+        loans.return_loan(self.student, loan.id)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.active_loans, 0)
+
+    def test_borrow_does_not_count_loans(self):
+        with CaptureQueriesContext(connection) as queries:
+            loans.borrow(self.student, self.book.id)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries))
+
+    @override_settings(LIBRARY_LOAN_LIMITS={'student': 1})
+    def test_loan_limit_is_configurable_per_role(self):
+        extra = Book.objects.create(title="Emma", author="Jane Austen", genre="Fiction")
+        loans.borrow(self.student, extra.id)
+        with self.assertRaisesMessage(loans.LoanError, "maximum of 1 books"):
+            loans.borrow(self.student, self.book.id)
+        admin = CustomUser.objects.create(username="librarian", role="admin")
+        loans.borrow(admin, self.book.id)
+
+    def test_reconcile_rebuilds_counters(self):
+        loans.borrow(self.student, self.book.id)
+        CustomUser.objects.update(active_loans=2)
+        call_command('reconcile_loans', stdout=StringIO())
+        self.student.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.student.active_loans, self.other.active_loans), (1, 0))
+
+    def test_views_report_refusals(self):
+        loan = loans.borrow(self.other, self.book.id)
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('borrow_book', args=[self.book.id]))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('return_book', args=[loan.id]))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('borrow_book', args=[9999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentBorrowTest(TransactionTestCase):
+    workers = 16
+
+    def test_exactly_one_concurrent_borrow_wins(self):
+        book = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        students = [
+            CustomUser.objects.create(username=f"student{i}", role="student")
+            for i in range(self.workers)
+        ]
+        barrier = threading.Barrier(self.workers)
+        results = []
+
+        def attempt(student):
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        loans.borrow(student, book.id)
+                        results.append('borrowed')
+                    except loans.LoanError:
+                        results.append('refused')
+                    except OperationalError:
+                        # Lock contention: retry like a client would
+                        continue
+                    break
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=attempt, args=(student,)) for student in students]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('borrowed'), 1)
+        self.assertEqual(results.count('refused'), self.workers - 1)
+        self.assertEqual(BorrowedBook.objects.filter(book=book).count(), 1)
+
+
+class RatingAggregateTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username="rater", role="student")
+        self.book = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+
+    def assertTotals(self, total, count):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (total, count))
+
+    def test_review_and_loan_ratings_are_folded_in(self):
+        review = Review.objects.create(book=self.book, user=self.user, rating=4, review_text="Good")
+        loan = loans.borrow(self.user, self.book.id)
+        self.assertTotals(4, 1)
+        loan.rating = 2
+        loan.save()
+        self.assertTotals(6, 2)
+        self.assertEqual(self.book.average_rating, 3)
+        review.rating = 5
+        review.save()
+        self.assertTotals(7, 2)
+        review.delete()
+        self.assertTotals(2, 1)
+        self.assertEqual(self.book.rating_avg, 2.0)
+
+    def test_recompute_repairs_drift(self):
+        Review.objects.create(book=self.book, user=self.user, rating=5, review_text="Great")
+        Book.objects.filter(id=self.book.id).update(rating_sum=0, rating_count=7, rating_avg=0)
+        self.assertEqual(recompute_ratings(dry_run=True), 1)
+        call_command('recompute_ratings', stdout=StringIO())
+        self.assertTotals(5, 1)
+        self.assertEqual(self.book.rating_avg, 5.0)
+        self.assertEqual(recompute_ratings(), 0)
+
+    def test_top_rated_listing_needs_no_per_book_queries(self):
+        for i, rating in enumerate([3, 5, 1]):
+            book = Book.objects.create(title=f"Book {i}", author="A", genre="G")
+            Review.objects.create(book=book, user=self.user, rating=rating, review_text="-")
+        self.client.force_login(CustomUser.objects.create(username="admin", role="admin"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('list_books_admin'), {'sort': 'rating'})
+        titles = [book.title for book in response.context['books']]
+        self.assertEqual(titles[:3], ["Book 1", "Book 0", "Book 2"])
+        self.assertEqual(sum('library_review' in q['sql'] for q in queries), 0)
+
+
+class UserAdminViewTest(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username="admin", role="admin")
+        self.client.force_login(self.admin)
+
+    def add_students(self, count):
+        for i in range(count):
+            student = CustomUser.objects.create(username=f"s{CustomUser.objects.count()}", role="student")
+            book = Book.objects.create(title=f"Book {student.id}", author="A", genre="G")
+            loans.borrow(student, book.id)
+
+    def count_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('view_users'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_users_or_loans(self):
+        self.add_students(2)
+        self.count_queries()  # caches the logged-in admin (library.auth)
+        small = self.count_queries()
+        self.add_students(10)
+        self.assertEqual(self.count_queries(), small)
+
+    def test_filters_by_role_and_overdue(self):
+        self.add_students(2)
+        late = BorrowedBook.objects.first()
+        late.due_date = timezone.now() - timedelta(days=1)
+        late.save()
+        response = self.client.get(reverse('view_users'), {'role': 'student', 'overdue': '1'})
+        members = list(response.context['users'])
+        self.assertEqual(members, [late.user])
+        self.assertTrue(members[0].open_loans[0].overdue)
+
+    def test_manage_users_is_super_admin_only(self):
+        self.assertEqual(self.client.get(reverse('manage_users')).status_code, 403)
+        self.client.force_login(CustomUser.objects.create(username="root", role="super_admin"))
+        self.assertEqual(self.client.get(reverse('manage_users')).status_code, 200)
+
+
+class CatalogFragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = CustomUser.objects.create(username="reader", role="student")
+        self.book = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        self.client.force_login(self.student)
+
+    def get_catalog(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('list_books_student'))
+        book_queries = [q for q in queries if 'FROM "library_book"' in q['sql']]
+        return response.content.decode(), len(book_queries)
+
+    def test_second_render_is_served_from_cache(self):
+        first, first_queries = self.get_catalog()
+        # Not through the ORM's signals, so the version stays put
+        Book.objects.filter(id=self.book.id).update(title="Renamed")
+        second, second_queries = self.get_catalog()
+        self.assertEqual(first, second)
+        self.assertNotIn("Renamed", second)
+        # The async view fetches its page before every render
+        self.assertEqual((first_queries, second_queries), (1, 1))
+
+    def test_book_changes_and_status_flips_bump_the_version(self):
+        self.get_catalog()
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title="Emma", author="Jane Austen", genre="Fiction")
+        self.assertGreater(catalog_version(), version)
+        self.assertIn("Emma", self.get_catalog()[0])
+
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            loans.borrow(self.student, self.book.id)
+        self.assertGreater(catalog_version(), version)
+        self.assertNotIn(reverse('borrow_book', args=[self.book.id]), self.get_catalog()[0])
+
+    def test_return_links_are_per_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = loans.borrow(self.student, self.book.id)
+        return_url = reverse('return_book', args=[loan.id])
+        self.student.refresh_from_db()
+        self.assertContains(self.client.get(reverse('book_list')), return_url)
+        self.client.force_login(CustomUser.objects.create(username="other", role="student"))
+        self.assertNotContains(self.client.get(reverse('book_list')), return_url)
+
+
+class ImportBooksCommandTest(TestCase):
+    def run_import(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_books', handle.name, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_dedupes_and_validates(self):
+        Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        out, err = self.run_import(
+            "title,author,genre\n"
+            "Dune,Frank Herbert,Science Fiction\n"
+            "Emma,Jane Austen,Fiction\n"
+            "Emma,Jane Austen,Fiction\n"
+            ",Nobody,Nothing\n"
+            "Beloved,Toni Morrison,Fiction\n",
+            '.csv', '--batch-size', '2',
+        )
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ["Beloved", "Dune", "Emma"])
+        self.assertIn("Imported 2 book(s) from 5 row(s): 2 duplicate(s), 1 invalid", out)
+        self.assertIn("line 5", err)
+
+    def test_jsonl_import_is_searchable(self):
+        self.run_import(
+            '{"title": "The Hobbit", "author": "J. R. R. Tolkien", "genre": "Fantasy"}\n'
+            'not json\n',
+            '.jsonl',
+        )
+        self.assertEqual([book.title for book in search_books(Book.objects.all(), "hobb")], ["The Hobbit"])
+
+    def test_jsonl_values_need_not_be_strings(self):
+        out, err = self.run_import(
+            '{"title": 1984, "author": "George Orwell", "genre": "Fiction"}\n'
+            '{"title": "Emma", "author": null, "genre": "Fiction"}\n'
+            '{"title": "Beloved", "author": "Toni Morrison", "genre": "Fiction"}\n',
+            '.jsonl', '--batch-size', '1',
+        )
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ["1984", "Beloved"])
+        self.assertIn("1 invalid", out)
+        self.assertIn("line 2", err)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username="admin", role="admin")
+        self.student = CustomUser.objects.create(username="reader", role="student")
+        self.dune = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        self.emma = Book.objects.create(title="Emma", author="Jane Austen", genre="Fiction")
+        loans.borrow(self.student, self.dune.id)
+
+    def test_streams_filtered_csv(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('export_data', args=['books']), {'genre': 'Fiction'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'title', 'author'])
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['Emma'])
+
+    def test_loans_jsonl_with_date_range(self):
+        self.client.force_login(self.admin)
+        today = timezone.now().date().isoformat()
+        response = self.client.get(reverse('export_data', args=['loans']), {'format': 'jsonl', 'since': today, 'status': 'open'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['user__username'], row['book__title']) for row in rows], [('reader', 'Dune')])
+        response = self.client.get(reverse('export_data', args=['loans']), {'until': '2000-01-01'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+
+    def test_students_and_bad_filters_are_refused(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(reverse('export_data', args=['users'])).status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('export_data', args=['users']), {'since': 'soon'}).status_code, 400)
+        for bound in ('2024-02-30', '2024-13-01T00:00:00'):
+            self.assertEqual(self.client.get(reverse('export_data', args=['loans']), {'since': bound}).status_code, 400)
+        with self.assertRaisesMessage(CommandError, "Invalid date: '2024-02-30'"):
+            call_command('export_data', 'loans', '--until', '2024-02-30', stdout=StringIO())
+        self.assertEqual(self.client.get(reverse('export_data', args=['secrets'])).status_code, 400)
+
+    def test_command_export(self):
+        out = StringIO()
+        call_command('export_data', 'users', '--role', 'student', '--format', 'jsonl', stdout=out)
+        self.assertEqual([json.loads(line)['username'] for line in out.getvalue().splitlines()], ['reader'])
+
+
+class OverdueTest(TestCase):
+    def setUp(self):
+        self.student = CustomUser.objects.create(username="reader", role="student")
+        self.books = [Book.objects.create(title=f"Book {i}", author="A", genre="G") for i in range(3)]
+        self.loans = [loans.borrow(self.student, book.id) for book in self.books]
+        now = timezone.now()
+        BorrowedBook.objects.filter(id=self.loans[0].id).update(due_date=now - timedelta(days=3, hours=1))
+        BorrowedBook.objects.filter(id=self.loans[1].id).update(due_date=now - timedelta(days=100))
+
+    def test_is_overdue_and_manager_agree(self):
+        overdue_ids = set(BorrowedBook.objects.overdue().values_list('id', flat=True))
+        self.assertEqual(overdue_ids, {self.loans[0].id, self.loans[1].id})
+        self.assertEqual({loan.id for loan in BorrowedBook.objects.all() if loan.is_overdue()}, overdue_ids)
+
+    @override_settings(LIBRARY_DAILY_FINE='0.50', LIBRARY_MAX_FINE='5.00')
+    def test_sweep_flags_and_fines_in_batches(self):
+        out = StringIO()
+        call_command('sweep_overdue', '--batch-size', '1', stdout=out)
+        self.assertIn("2 overdue loan(s), 2 newly flagged, 7.00 in outstanding fines", out.getvalue())
+        fines = dict(BorrowedBook.objects.values_list('id', 'fine'))
+        self.assertEqual(fines[self.loans[0].id], Decimal('2.00'))
+        self.assertEqual(fines[self.loans[1].id], Decimal('5.00'))
+        self.assertEqual(fines[self.loans[2].id], Decimal('0'))
+
+        out = StringIO()
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn("0 newly flagged", out.getvalue())
+
+    def test_dashboard_shows_overdue_count(self):
+        self.client.force_login(self.student)
+        self.assertContains(self.client.get(reverse('student_dashboard')), "You have 2 overdue books")
+        self.client.force_login(CustomUser.objects.create(username="admin", role="admin"))
+        self.assertContains(self.client.get(reverse('admin_dashboard')), "2 overdue loans")
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTest(TestCase):
+    """The queries behind each view must be answered from an index, not a table scan.
+
+    Each test runs the ORM query a view issues through EXPLAIN QUERY PLAN on
+    a seeded catalog. A plan line like ``SCAN library_book`` (no index) or a
+    temporary B-tree for ORDER BY means someone reintroduced a full scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = ["Fantasy", "Fiction", "History", "Poetry", "Science"]
+        Book.objects.bulk_create(
+            Book(title=f"Title {i:05d}", author=f"Author {i % 500}", genre=genres[i % 5],
+                 status='borrowed' if i % 7 == 0 else 'available')
+            for i in range(5000)
+        )
+        CustomUser.objects.bulk_create(
+            CustomUser(username=f"user{i:04d}", role='admin' if i % 50 == 0 else 'student')
+            for i in range(500)
+        )
+        cls.user = CustomUser.objects.get(username="user0001")
+        cls.book = Book.objects.first()
+        users = list(CustomUser.objects.all())
+        books = list(Book.objects.all())
+        now = timezone.now()
+        BorrowedBook.objects.bulk_create(
+            BorrowedBook(
+                user=users[i % len(users)], book=books[i % len(books)],
+                due_date=now + timedelta(days=(i % 30) - 20),
+                returned_at=now if i % 3 else None,
+            )
+            for i in range(8000)
+        )
+        Review.objects.bulk_create(
+            Review(user=users[i % len(users)], book=books[i], rating=1 + i % 5, review_text="-")
+            for i in range(2000)
+        )
+
+    def assertUsesIndex(self, queryset, allow_sort=False):
+        plan = queryset.explain()
+        # Scanning a subquery's own (already bounded) rows is not a table scan
+        coroutines = set(re.findall(r'CO-ROUTINE (\w+)', plan))
+        for line in plan.splitlines():
+            detail = line.split(' ', 3)[-1]
+            if detail.removeprefix('SCAN ') in coroutines:
+                continue
+            self.assertNotRegex(detail, r'^SCAN \w+$', f"full table scan in plan:\n{plan}")
+            if not allow_sort:
+                self.assertNotIn('USE TEMP B-TREE', detail, f"unindexed sort in plan:\n{plan}")
+
+    def test_catalog_pages(self):
+        cursor = ['Title 02500', 2500]
+        for ordering in [('title', 'id'), ('-rating_avg', '-id')]:
+            books = Book.objects.order_by(*ordering)
+            self.assertUsesIndex(books[:26])
+        self.assertUsesIndex(Book.objects.order_by('title', 'id').filter(after_q(('title', 'id'), cursor))[:26])
+        self.assertUsesIndex(Book.objects.order_by('-rating_avg', '-id').filter(after_q(('-rating_avg', '-id'), [3.0, 10]))[:26])
+
+    def test_search(self):
+        # Ranked results are sorted after matching, but never scanned for
+        self.assertUsesIndex(search_books(Book.objects.all(), "title 0012")[:26], allow_sort=True)
+
+    def test_fuzzy_search(self):
+        # Candidates come from the trigram posting lists, not every book
+        fuzzy.rebuild_trigrams()
+        self.assertUsesIndex(fuzzy.fuzzy_match(Book.objects.all(), "titel 0012").order_by('search_rank', 'id')[:26], allow_sort=True)
+
+    def test_catalog_filters(self):
+        # The querysets book_list and the JSON API build (views.filter_catalog)
+        for params, index in [({'genre': 'Poetry'}, 'book_genre_idx'), ({'status': 'borrowed'}, 'book_status_idx')]:
+            books, ordering = views.filter_catalog(RequestFactory().get('/', params))
+            page = books.order_by(*ordering)[:26]
+            self.assertUsesIndex(page, allow_sort=True)
+            self.assertIn(index, page.explain())
+
+    def test_facet_counts(self):
+        # Each facet groups over its column's index, author's included
+        for name, queryset in facet_queries(Book.objects.all(), {}).items():
+            self.assertUsesIndex(queryset, allow_sort=True)
+            self.assertIn(f'COVERING INDEX book_{name}_idx', queryset.explain())
+
+    def test_borrow_and_return(self):
+        self.assertUsesIndex(Book.objects.filter(id=self.book.id, status='available'))
+        self.assertUsesIndex(CustomUser.objects.filter(id=self.user.id, active_loans__lt=3))
+        self.assertUsesIndex(BorrowedBook.objects.filter(id=1, user=self.user, returned_at__isnull=True))
+
+    def test_student_pages(self):
+        self.assertUsesIndex(BorrowedBook.objects.filter(user=self.user, returned_at__isnull=True))
+        self.assertUsesIndex(BorrowedBook.objects.filter(user=self.user))
+        self.assertUsesIndex(BorrowedBook.objects.overdue().filter(user=self.user))
+
+    def test_overdue(self):
+        self.assertUsesIndex(BorrowedBook.objects.overdue())
+        self.assertUsesIndex(BorrowedBook.objects.overdue().order_by('due_date', 'id')[:500])
+
+    def test_user_admin_pages(self):
+        self.assertUsesIndex(CustomUser.objects.order_by('username')[:26])
+        self.assertUsesIndex(CustomUser.objects.filter(role='admin').order_by('username')[:26])
+        user_ids = list(CustomUser.objects.order_by('username').values_list('id', flat=True)[:26])
+        self.assertUsesIndex(BorrowedBook.objects.open().filter(user__in=user_ids).select_related('book'))
+
+    def test_review_lookup(self):
+        self.assertUsesIndex(Review.objects.filter(user=self.user, book=self.book))
+
+
+class TunedSQLiteBackendTest(TestCase):
+    def open_wrapper(self, path, **options):
+        wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': path,
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', **options},
+        }, alias='tuned_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'tuned.sqlite3')
+
+    def test_pragmas_are_applied_on_connect(self):
+        wrapper = self.open_wrapper(self.path, pragmas={'cache_size': -1024})
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1024)
+
+    def test_locked_writes_are_retried_with_backoff(self):
+        wrapper = self.open_wrapper(self.path, pragmas={'busy_timeout': 10}, lock_retries=8, lock_retry_delay=0.02)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (n INTEGER)')
+
+        holder = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        holder.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.1, holder.execute, args=['COMMIT'])
+        release.start()
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO t (n) VALUES (1)')
+                cursor.execute('SELECT count(*) FROM t')
+                self.assertEqual(cursor.fetchone()[0], 1)
+        finally:
+            release.join()
+            holder.close()
+
+
+@override_settings(LIBRARY_READ_REPLICA='replica')
+class ReadReplicaRoutingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.student = CustomUser.objects.create(username="reader", role="student")
+
+    def databases_seen(self, user):
+        @read_replica
+        def view(request):
+            return Book.objects.all().db, CustomUser.objects.all().db, Session.objects.all().db
+
+        request = self.factory.get('/')
+        request.user = user
+        return view(request)
+
+    def test_read_only_views_read_library_models_from_the_replica(self):
+        self.assertEqual(self.databases_seen(AnonymousUser()), ('replica', 'replica', 'default'))
+        self.assertEqual(Book.objects.all().db, 'default')
+        self.assertEqual(PrimaryReplicaRouter().db_for_write(Book), 'default')
+
+    def test_writers_are_pinned_to_the_primary(self):
+        pin_to_primary(self.student.id)
+        self.assertEqual(self.databases_seen(self.student), ('default', 'default', 'default'))
+        other = CustomUser.objects.create(username="other", role="student")
+        self.assertEqual(self.databases_seen(other)[0], 'replica')
+
+    def test_borrowing_pins_the_borrower(self):
+        book = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        self.client.force_login(self.student)
+        self.client.get(reverse('borrow_book', args=[book.id]))
+        self.assertTrue(is_pinned(self.student.id))
+
+    @override_settings(LIBRARY_READ_REPLICA=None)
+    def test_no_replica_configured(self):
+        self.assertEqual(self.databases_seen(AnonymousUser()), ('default', 'default', 'default'))
+
+    def test_replicate_copies_a_consistent_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary, replica = os.path.join(directory, 'primary.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+        with sqlite3.connect(primary) as db:
+            db.execute('CREATE TABLE t (n INTEGER)')
+            db.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(100)])
+        replicate(primary, replica)
+        with sqlite3.connect(replica) as db:
+            self.assertEqual(db.execute('SELECT count(*) FROM t').fetchone()[0], 100)
+
+
+class CatalogApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = CustomUser.objects.create(username="reader", role="student")
+        self.dune = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        self.emma = Book.objects.create(title="Emma", author="Jane Austen", genre="Fiction")
+        self.hobbit = Book.objects.create(title="The Hobbit", author="J.R.R. Tolkien", genre="Fantasy")
+
+    def test_listing_is_cursor_paginated(self):
+        response = self.client.get(reverse('api_books'), {'page_size': 2})
+        data = response.json()
+        self.assertEqual([book['title'] for book in data['results']], ['Dune', 'Emma'])
+        self.assertEqual(set(data['results'][0]), {'id', 'title', 'author', 'genre', 'status', 'rating_avg', 'rating_count', 'updated_at'})
+        data = self.client.get(reverse('api_books'), {'page_size': 2, 'after': data['next']}).json()
+        self.assertEqual([book['title'] for book in data['results']], ['The Hobbit'])
+        self.assertIsNone(data['next'])
+
+    def test_search_reuses_the_book_list_filters(self):
+        data = self.client.get(reverse('api_book_search'), {'search': 'hobbit'}).json()
+        self.assertEqual([book['id'] for book in data['results']], [self.hobbit.id])
+        # genre is an exact match, not a substring
+        data = self.client.get(reverse('api_books'), {'genre': 'Fiction'}).json()
+        self.assertEqual([book['title'] for book in data['results']], ['Emma'])
+        self.assertEqual(self.client.get(reverse('api_book_search')).status_code, 400)
+
+    def test_unchanged_listing_is_answered_with_304(self):
+        response = self.client.get(reverse('api_books'))
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('Last-Modified', response)
+        # Only the validator query runs; no book rows are read
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api_books'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            loans.borrow(self.student, self.dune.id)
+        response = self.client.get(reverse('api_books'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deleting_a_book_changes_the_etag(self):
+        etag = self.client.get(reverse('api_books'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.emma.delete()
+        self.assertEqual(self.client.get(reverse('api_books'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_delete_in_another_process_changes_the_etag(self):
+        etag = self.client.get(reverse('api_books'))['ETag']
+        version = catalog_version()
+        # As in another worker: its version bump never reaches this cache
+        self.dune.delete()
+        self.assertEqual(catalog_version(), version)
+        response = self.client.get(reverse('api_books'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Dune', [book['title'] for book in response.json()['results']])
+
+    def test_book_detail_revalidates_on_its_own_updated_at(self):
+        url = reverse('api_book_detail', args=[self.dune.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['title'], 'Dune')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A loan on another book leaves this one's tag alone ...
+        Book.objects.filter(pk=self.emma.pk).update(status='borrowed', updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # ... a rating on this one does not
+        Review.objects.create(book=self.dune, user=self.student, rating=5, review_text="Great")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rating_count'], 1)
+
+        self.assertEqual(self.client.get(reverse('api_book_detail', args=[9999])).status_code, 404)
+
+
+class AsyncViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = CustomUser.objects.create(username="reader", role="student")
+        self.admin = CustomUser.objects.create(username="admin", role="admin")
+        self.dune = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        self.emma = Book.objects.create(title="Emma", author="Jane Austen", genre="Fiction")
+
+    def test_read_heavy_views_are_async(self):
+        for view in [views.book_list, views.list_books_student, views.student_dashboard,
+                     views.admin_dashboard, views.superadmin_dashboard, views.api_book_search]:
+            self.assertTrue(iscoroutinefunction(view), view.__name__)
+
+    async def test_search_page_under_asgi(self):
+        loan = await sync_to_async(loans.borrow)(self.student, self.dune.id)
+        await self.async_client.aforce_login(self.student)
+        response = await self.async_client.get(reverse('book_list'), {'search': 'emma'})
+        self.assertContains(response, "Jane Austen")
+        # The per-user block lists the student's open loans
+        self.assertContains(response, reverse('return_book', args=[loan.id]))
+
+    async def test_role_required_on_async_views(self):
+        await self.async_client.aforce_login(self.student)
+        self.assertEqual((await self.async_client.get(reverse('admin_dashboard'))).status_code, 403)
+        response = await self.async_client.get(reverse('list_books_student'))
+        self.assertContains(response, "Emma")
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(reverse('admin_dashboard'))
+        self.assertContains(response, "Welcome, admin")
+
+    async def test_async_search_api_revalidates(self):
+        response = await self.async_client.get(reverse('api_book_search'), {'search': 'dune'})
+        self.assertEqual([book['title'] for book in response.json()['results']], ['Dune'])
+        etag = response['ETag']
+        response = await self.async_client.get(reverse('api_book_search'), {'search': 'dune'}, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+    async def test_async_views_never_touch_the_cache_on_the_event_loop(self):
+        def on_loop():
+            try:
+                return asyncio.get_running_loop() is not None
+            except RuntimeError:
+                return False
+
+        blocking = []
+
+        def guard(method):
+            def guarded(self, *args, **kwargs):
+                if on_loop():
+                    blocking.append(method.__name__)
+                return method(self, *args, **kwargs)
+            return guarded
+
+        superadmin = await CustomUser.objects.acreate(username="root", role="super_admin")
+        await self.async_client.aforce_login(superadmin)
+        patches = [
+            mock.patch.object(LocMemCache, name, guard(getattr(LocMemCache, name)))
+            for name in ('get', 'get_many', 'add', 'set', 'incr')
+        ]
+        with mock.patch('library.routers.replica_alias', return_value='default'):
+            for patch in patches:
+                patch.start()
+                self.addCleanup(patch.stop)
+            for name, params in [('book_list', {'search': 'dune'}), ('superadmin_dashboard', {}),
+                                 ('api_book_search', {'search': 'dune'}), ('list_books_student', {})]:
+                if name == 'list_books_student':
+                    await self.async_client.aforce_login(self.student)
+                response = await self.async_client.get(reverse(name), params)
+                self.assertEqual(response.status_code, 200, name)
+        self.assertEqual(blocking, [])
+
+
+class LowWriteSessionTest(TestCase):
+    def run_middleware(self, session_key, view):
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+        return LowWriteSessionMiddleware(lambda request: view(request) or HttpResponse())(request)
+
+    def make_session(self, **data):
+        session = SessionStore()
+        session.update(data)
+        session.create()
+        return session.session_key
+
+    def test_unchanged_sessions_are_not_saved(self):
+        key = self.make_session(shelf='fiction')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.run_middleware(key, lambda request: request.session.__setitem__('shelf', 'fiction'))
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual([q['sql'] for q in queries if 'UPDATE' in q['sql'] or 'INSERT' in q['sql']], [])
+
+    def test_sessions_loaded_by_async_views_are_not_saved(self):
+        key = self.make_session(shelf='fiction')
+
+        @read_replica
+        async def view(request):
+            await request.session.aset('shelf', 'fiction')
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = key
+        # resolve_user() loads the session through request.auser(), i.e. aload()
+        request.auser = lambda: auth.aget_user(request)
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(LowWriteSessionMiddleware(view))(request)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual([q['sql'] for q in queries if 'UPDATE' in q['sql'] or 'INSERT' in q['sql']], [])
+
+    def test_changed_and_cycled_sessions_are_saved(self):
+        key = self.make_session(shelf='fiction')
+        response = self.run_middleware(key, lambda request: request.session.__setitem__('shelf', 'poetry'))
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(SessionStore(session_key=key)['shelf'], 'poetry')
+
+        # Same data under a new key, as after login: the new cookie must go out
+        response = self.run_middleware(key, lambda request: request.session.cycle_key())
+        new_key = response.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(SessionStore(session_key=new_key)['shelf'], 'poetry')
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies',
+        MESSAGE_STORAGE='django.contrib.messages.storage.cookie.CookieStorage',
+    )
+    def test_signed_cookie_mode_never_touches_the_session_table(self):
+        self.client.force_login(CustomUser.objects.create(username="admin", role="admin"))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('admin_dashboard'))
+            response = self.client.post(reverse('add_book'), {'title': 'Dune', 'author': 'Frank Herbert', 'genre': 'Science Fiction', 'status': 'available'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('messages', response.cookies)
+        self.assertEqual([q['sql'] for q in queries if 'django_session' in q['sql']], [])
+
+    def test_purge_expired_sessions_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            Session(session_key=f'key{i:03d}', session_data='', expire_date=now + timedelta(days=1 if i % 4 == 0 else -1))
+            for i in range(20)
+        )
+        self.assertEqual(purge_expired_sessions(batch_size=4), 15)
+        self.assertEqual(Session.objects.count(), 5)
+        out = StringIO()
+        call_command('purge_sessions', '--batch-size', '2', stdout=out)
+        self.assertIn("Purged 0 expired session(s).", out.getvalue())
+
+
+class CachedUserBackendTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.superadmin = CustomUser.objects.create(username="boss", role="super_admin")
+        self.student = CustomUser.objects.create(username="reader", role="student")
+
+    def user_queries(self, client, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse(name))
+        return response, sum('FROM "library_customuser"' in q['sql'] for q in queries)
+
+    def test_requests_skip_the_user_query_once_cached(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.user_queries(self.client, 'list_books_student')[1], 1)
+        response, user_queries = self.user_queries(self.client, 'list_books_student')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_queries, 0)
+
+    def test_banned_students_are_locked_out_immediately(self):
+        student_client = Client()
+        student_client.force_login(self.student)
+        self.user_queries(student_client, 'list_books_student')
+        self.client.force_login(self.superadmin)
+        self.client.get(reverse('ban_student', args=[self.student.id]))
+        response = student_client.get(reverse('list_books_student'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(settings.LOGIN_URL, response['Location'])
+
+    def test_role_changes_and_password_changes_apply_to_the_next_request(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(reverse('list_books_student')).status_code, 200)
+        self.student.role = 'admin'
+        self.student.save()
+        self.assertEqual(self.client.get(reverse('list_books_student')).status_code, 403)
+        self.student.set_password("a new secret")
+        self.student.save()
+        self.assertEqual(self.client.get(reverse('list_books_student')).status_code, 302)
+
+    def test_loans_refresh_the_cached_counter(self):
+        self.client.force_login(self.student)
+        self.client.get(reverse('book_list'))
+        book = Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+        loan = loans.borrow(self.student, book.id)
+        self.assertContains(self.client.get(reverse('book_list')), reverse('return_book', args=[loan.id]))
+
+
+@override_settings(
+    LIBRARY_LOGIN_THROTTLE={'ip': {'burst': 4, 'per_minute': 1}, 'username': {'burst': 2, 'per_minute': 1}},
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class LoginThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.fallback.attempts.clear()
+        self.student = CustomUser.objects.create_user(username="reader", password="right horse battery", role="student")
+
+    def attempt(self, username, ip='10.0.0.1', password='wrong'):
+        client = Client(REMOTE_ADDR=ip)
+        return client.post(reverse('login'), {'username': username, 'password': password})
+
+    def test_excess_attempts_are_rejected_before_hashing(self):
+        with mock.patch('django.contrib.auth.forms.authenticate', wraps=authenticate) as checked:
+            statuses = [self.attempt(f"user{n}").status_code for n in range(6)]
+        self.assertEqual(statuses, [200, 200, 200, 200, 429, 429])
+        self.assertEqual(checked.call_count, 4)
+        self.assertEqual(throttle.counters(), {'processed': 4, 'rejected': 2})
+        self.assertGreater(int(self.attempt("user9")['Retry-After']), 0)
+
+    def test_usernames_are_throttled_across_ips(self):
+        statuses = [self.attempt("reader", ip=f"10.0.0.{n}").status_code for n in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        # Other accounts are unaffected
+        response = self.attempt("someone", ip="10.0.0.9")
+        self.assertEqual(response.status_code, 200)
+
+    def test_a_real_login_still_goes_through(self):
+        response = self.attempt("reader", password="right horse battery")
+        self.assertRedirects(response, reverse('student_dashboard'), fetch_redirect_response=False)
+
+    def test_sliding_window_fallback_when_the_cache_fails(self):
+        with mock.patch.object(throttle.cache, 'get', side_effect=ConnectionError):
+            statuses = [self.attempt("reader", ip="10.0.0.2").status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        Book.objects.create(title="Dune", author="Frank Herbert", genre="Science Fiction")
+
+    def test_server_timing_reports_sql_and_templates(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_list'))
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'app', 'db', 'tpl'})
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+        self.assertNotEqual(timing['tpl'], 'dur=0.0')
+
+    def test_metrics_endpoint_is_for_super_admins(self):
+        self.client.get(reverse('book_list'))
+        self.client.get(reverse('book_list'), {'search': 'dune'})
+        self.client.force_login(CustomUser.objects.create(username="admin", role="admin"))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(CustomUser.objects.create(username="boss", role="super_admin"))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE library_request_duration_seconds histogram', body)
+        self.assertIn('library_request_duration_seconds_count{view="book_list"} 2', body)
+        self.assertIn('library_request_queries_bucket{view="book_list",le="+Inf"} 2', body)
+        self.assertIn('library_login_attempts_total{outcome="rejected"} 0', body)
+
+    @override_settings(LIBRARY_SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged_with_their_view(self):
+        with self.assertLogs('library.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('api_books'))
+        self.assertTrue(any('in api_books:' in line and 'library_book' in line for line in logs.output))
+
+
+class SeededBenchmarkTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stats = seed_library(books=300, users=40, loans=500, batch_size=128)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_is_consistent(self):
+        self.assertEqual((self.stats.books, self.stats.users, self.stats.loans), (300, 40, 500))
+        self.assertEqual(BorrowedBook.objects.filter(returned_at__isnull=True).count(), self.stats.open_loans)
+        self.assertEqual(
+            Book.objects.filter(status='borrowed').count(),
+            BorrowedBook.objects.filter(returned_at__isnull=True).values('book').distinct().count(),
+        )
+        for user in CustomUser.objects.filter(role='student'):
+            self.assertLessEqual(user.active_loans, loans.MAX_OPEN_LOANS)
+            self.assertEqual(user.active_loans, user.borrowedbook_set.filter(returned_at__isnull=True).count())
+        self.assertFalse(BorrowedBook.objects.filter(borrowed_at__gt=timezone.now()).exists())
+        self.assertFalse(BorrowedBook.objects.filter(returned_at__gt=timezone.now()).exists())
+
+    def test_every_view_stays_within_its_query_budget(self):
+        results = benchmarks.run_view_benchmarks(repeat=2)
+        self.assertEqual([row['view'] for row in results], list(benchmarks.VIEW_CASES))
+        self.assertEqual(benchmarks.check_results(results), [])
+        # The run is rolled back
+        self.assertFalse(CustomUser.objects.filter(username__startswith='bench-views-').exists())
+
+    def test_regressions_against_a_baseline_fail(self):
+        row = {'view': 'book_list', 'requests': 2, 'median_ms': 10.0, 'p95_ms': 12.0, 'max_queries': 3, 'budget': 4}
+        self.assertEqual(benchmarks.check_results([row], [dict(row, median_ms=9.0)]), [])
+        self.assertEqual(len(benchmarks.check_results([row], [dict(row, median_ms=5.0, max_queries=2)])), 2)
+        self.assertEqual(len(benchmarks.check_results([dict(row, max_queries=5)])), 1)
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        self.books = [Book.objects.create(title=f"Book {n}", author="Author", genre="Fiction") for n in range(4)]
+        self.users = [CustomUser.objects.create(username=f"reader{n}", role='student') for n in range(4)]
+        due = timezone.now() + loans.LOAN_PERIOD
+        # reader0: books 0, 1; reader1: books 0, 1, 2 (2 rated 5); reader2: book 2
+        for user, book, rating in [(0, 0, None), (0, 1, None), (1, 0, None), (1, 1, None), (1, 2, 5), (2, 2, None)]:
+            BorrowedBook.objects.create(
+                user=self.users[user], book=self.books[book], due_date=due, returned_at=due, rating=rating,
+            )
+
+    def neighbours(self, book):
+        return [
+            (neighbour, round(score, 4))
+            for neighbour, score in BookNeighbour.objects.filter(book=book).order_by('-score').values_list('neighbour', 'score')
+        ]
+
+    def test_rebuild_scores_cosine_similarity(self):
+        self.assertEqual(recommendations.rebuild_neighbours(vectorized=False), 3)
+        b0, b1, b2 = (book.id for book in self.books[:3])
+        self.assertEqual(self.neighbours(b0), [(b1, 1.0), (b2, round((5 / 3) / (2 ** 0.5 * ((5 / 3) ** 2 + 1) ** 0.5), 4))])
+        self.assertEqual(self.neighbours(self.books[3].id), [])
+
+    @unittest.skipUnless(recommendations.sparse is not None, "NumPy and SciPy are not installed")
+    def test_vectorized_rebuild_matches_pure_python(self):
+        recommendations.rebuild_neighbours(vectorized=False)
+        expected = {book.id: self.neighbours(book) for book in self.books}
+        recommendations.rebuild_neighbours(vectorized=True)
+        self.assertEqual({book.id: self.neighbours(book) for book in self.books}, expected)
+
+    def test_new_loans_are_queued_and_refresh_the_rows_they_touch(self):
+        recommendations.rebuild_neighbours(vectorized=False)
+        loans.borrow(self.users[2], self.books[3].id)
+        self.assertEqual(self.neighbours(self.books[3]), [])
+        self.assertEqual(NeighbourRefresh.objects.count(), 1)
+        self.assertEqual(recommendations.refresh_pending(vectorized=False), 2)
+        self.assertFalse(NeighbourRefresh.objects.exists())
+        refreshed = {book.id: self.neighbours(book) for book in (self.books[2], self.books[3])}
+        recommendations.rebuild_neighbours(vectorized=False)
+        self.assertEqual(refreshed, {book.id: self.neighbours(book) for book in (self.books[2], self.books[3])})
+        self.assertEqual([n for n, _ in self.neighbours(self.books[3])], [self.books[2].id])
+
+    @unittest.skipUnless(recommendations.sparse is not None, "NumPy and SciPy are not installed")
+    def test_vectorized_refresh_matches_pure_python(self):
+        recommendations.rebuild_neighbours(vectorized=False)
+        loans.borrow_many(self.users[2], [self.books[0].id, self.books[3].id])
+        self.assertEqual(recommendations.refresh_pending(vectorized=True), 3)
+        touched = (self.books[0], self.books[2], self.books[3])  # reader2's history
+        refreshed = {book.id: self.neighbours(book) for book in touched}
+        recommendations.rebuild_neighbours(vectorized=False)
+        self.assertEqual(refreshed, {book.id: self.neighbours(book) for book in touched})
+
+    def test_dashboard_recommends_unborrowed_neighbours_in_one_query(self):
+        recommendations.rebuild_neighbours(vectorized=False)
+        reader = self.users[2]  # has only read book 2
+        with CaptureQueriesContext(connection) as queries:
+            recommended = list(recommendations.recommended_for(reader))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([book['neighbour_id'] for book in recommended], [self.books[0].id, self.books[1].id])
+
+        self.client.force_login(reader)
+        response = self.client.get(reverse('student_dashboard'))
+        self.assertContains(response, "Borrowers of Your Books Also Borrowed")
+        self.assertContains(response, "Book 0")
+
+
+class FacetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for title, author, genre, status in [
+            ("Dune", "Frank Herbert", "Science Fiction", "available"),
+            ("Dune Messiah", "Frank Herbert", "Science Fiction", "borrowed"),
+            ("Emma", "Jane Austen", "Fiction", "available"),
+            ("Persuasion", "Jane Austen", "Fiction", "available"),
+            ("Dune Road", "Jane Austen", "Fiction", "borrowed"),
+        ]:
+            Book.objects.create(title=title, author=author, genre=genre, status=status)
+
+    def facets(self, **params):
+        return self.client.get(reverse('book_list'), params).context['facets']
+
+    def test_counts_cover_the_search_and_the_other_filters(self):
+        facets = self.facets(search='dune', genre='Fiction')
+        # genre ignores its own filter so the other genres stay visible
+        self.assertEqual(facets['genre'], [('Science Fiction', 2), ('Fiction', 1)])
+        self.assertEqual(facets['author'], [('Jane Austen', 1)])
+        self.assertEqual(facets['status'], [('borrowed', 1)])
+
+    def test_genre_and_status_are_exact_matches(self):
+        response = self.client.get(reverse('book_list'), {'genre': 'Fiction', 'status': 'available'})
+        self.assertEqual([book.title for book in response.context['books']], ["Emma", "Persuasion"])
+        self.assertContains(response, '<option value="Fiction" selected>Fiction (2)</option>')
+
+    def test_counts_are_cached_until_the_catalog_changes(self):
+        self.facets(genre='Fiction')
+        with CaptureQueriesContext(connection) as queries:
+            self.facets(genre=' Fiction', author='JANE')
+            self.facets(genre='Fiction', author='jane ')
+        self.assertEqual(sum('GROUP BY' in query['sql'] for query in queries), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title="Sanditon", author="Jane Austen", genre="Fiction")
+        self.assertEqual(self.facets(genre='Fiction')['genre'], [('Fiction', 4), ('Science Fiction', 2)])
+
+    def test_selected_genre_outside_the_top_values_stays_selected(self):
+        with mock.patch('library.facets.FACET_LIMIT', 1):
+            response = self.client.get(reverse('book_list'), {'genre': 'Science Fiction'})
+        self.assertEqual(response.context['facets']['genre'], [('Fiction', 3), ('Science Fiction', None)])
+        self.assertContains(response, '<option value="Science Fiction" selected>Science Fiction</option>')
+        self.assertEqual(len(response.context['books']), 2)
+
+
+class TypeaheadTest(TestCase):
+    def setUp(self):
+        typeahead.discard_index()
+        self.addCleanup(typeahead.discard_index)
+        self.hobbit = Book.objects.create(title="The Hobbit", author="J.R.R. Tolkien", genre="Fantasy")
+        Book.objects.create(title="Harry Potter", author="J.K. Rowling", genre="Fantasy")
+        Book.objects.create(title="Les Misérables", author="Victor Hugo", genre="Fiction")
+
+    def suggest(self, prefix, **params):
+        response = self.client.get(reverse('api_book_suggest'), {'q': prefix, **params})
+        return [suggestion['text'] for suggestion in response.json()['suggestions']]
+
+    def test_prefix_index(self):
+        index = typeahead.PrefixIndex().load([("Dune", "Frank Herbert"), ("Dune", "Frank Herbert"), ("A Dune Sea", "Anon")])
+        self.assertEqual(index.lookup("du"), [{'text': "Dune", 'kind': 'title'}, {'text': "A Dune Sea", 'kind': 'title'}])
+        self.assertEqual(index.lookup("FRANK h"), [{'text': "Frank Herbert", 'kind': 'author'}])
+        self.assertEqual(index.lookup("du", limit=1), [{'text': "Dune", 'kind': 'title'}])
+        self.assertEqual(index.lookup("  "), [])
+        # Two books share the title, so one removal keeps it
+        index.remove('title', "Dune")
+        self.assertEqual(len(index.lookup("dune")), 2)
+        index.remove('title', "Dune")
+        index.remove('title', "A Dune Sea")
+        self.assertEqual(index.lookup("d"), [])
+        index.add('title', "Dust")
+        self.assertEqual(index.lookup("d"), [{'text': "Dust", 'kind': 'title'}])
+
+    def test_index_is_bounded(self):
+        index = typeahead.PrefixIndex(max_keys=3).load([("Emma", "Jane Austen"), ("Dune", "Frank Herbert")])
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.full)
+
+    def test_endpoint_answers_from_memory(self):
+        self.assertEqual(self.suggest("hob"), ["The Hobbit"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest("the h"), ["The Hobbit"])
+            self.assertEqual(self.suggest("les mis"), ["Les Misérables"])
+            self.assertEqual(self.suggest("les mis"), self.suggest("LES MIS"))
+            self.assertEqual(self.suggest("j", limit=1), ["J.K. Rowling"])
+            self.assertEqual(self.suggest(""), [])
+
+    def test_saves_and_deletes_update_the_loaded_index(self):
+        self.suggest("h")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hobbit.title = "The Silmarillion"
+            self.hobbit.save()
+        self.assertEqual(self.suggest("s"), ["The Silmarillion"])
+        self.assertEqual(self.suggest("hob"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hobbit.delete()
+        self.assertEqual(self.suggest("silm"), [])
+        self.assertEqual(self.suggest("j.r"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title="Hamlet", author="William Shakespeare", genre="Drama")
+        self.assertEqual(self.suggest("ha"), ["Hamlet", "Harry Potter"])
+
+
+class FuzzySearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hobbit = Book.objects.create(title="The Hobbit", author="J. R. R. Tolkien", genre="Fantasy")
+        self.emma = Book.objects.create(title="Emma", author="Jane Austen", genre="Fiction")
+        self.pride = Book.objects.create(title="Pride and Prejudice", author="Jane Austen", genre="Fiction")
+
+    def search(self, text):
+        return list(search_books(Book.objects.all(), text))
+
+    def test_misspellings_fall_back_to_trigram_matches(self):
+        self.assertEqual(self.search("tolkein"), [self.hobbit])
+        self.assertEqual(self.search("jane austin"), [self.emma, self.pride])
+        self.assertEqual(self.search("pride prejudise")[0], self.pride)
+        self.assertEqual(self.search("zzyzx"), [])
+
+    def test_common_trigrams_are_skipped_without_losing_matches(self):
+        queries = ["tolkein", "jane austin", "pride prejudise", "emma", "zzyzx"]
+        expected = [self.search(text) for text in queries]
+        self.assertEqual(fuzzy._posting_counts({"  j", "zzz"}), {"  j": 3, "zzz": 0})
+        with mock.patch('library.fuzzy.POSTING_LIMIT', 1):
+            self.assertEqual(fuzzy._posting_counts({"  j"}), {"  j": 2})
+            self.assertEqual([self.search(text) for text in queries], expected)
+        with mock.patch('library.fuzzy.POSTING_LIMIT', 0):
+            # Every trigram is common: the first postings of each still rank
+            self.assertEqual(self.search("tolkein"), [self.hobbit])
+            self.assertEqual(self.search("jane austin"), [self.emma])
+
+    def test_exact_hits_rank_ahead_of_close_matches(self):
+        Book.objects.bulk_create(Book(title=f"The Sea {n}", author="Sam Smith", genre="Fiction") for n in range(20))
+        fuzzy.rebuild_trigrams()
+        sun = Book.objects.create(title="The Sun", author="Ernest Hemingway", genre="Fiction")
+        with mock.patch('library.fuzzy.POSTING_LIMIT', 10), mock.patch('library.fuzzy.MAX_CANDIDATES', 5):
+            books = self.search("the sun")
+        self.assertEqual(books[0], sun)
+        self.assertEqual(len(books), 6)
+
+    def test_close_matches_clear_the_threshold(self):
+        udoku = Book.objects.create(title="Udoku", author="Anon", genre="Puzzles")
+        sudoku = Book.objects.create(title="Sudoku Zebra", author="Anon", genre="Puzzles")
+        # Make the word-start trigrams "  s" and "  z" common
+        Book.objects.bulk_create(Book(title=title, author="Anon", genre="Puzzles") for title in ["Sam", "Sid", "Zed", "Zoo"])
+        fuzzy.rebuild_trigrams()
+        with mock.patch('library.fuzzy.POSTING_LIMIT', 2):
+            books = list(fuzzy.fuzzy_match(Book.objects.all(), "sudoku zebra"))
+        # Udoku shares 4 of the 13 trigrams, enough of the rare ones to be a candidate
+        self.assertEqual(books, [sudoku])
+        self.assertGreaterEqual(books[0].trigram_score, fuzzy.THRESHOLD)
+
+    def test_exact_hits_are_kept_when_there_are_enough(self):
+        with mock.patch('library.search.FUZZY_MIN_HITS', 1):
+            books = search_books(Book.objects.all(), "austen")
+        self.assertFalse(fuzzy.is_fuzzy(books))
+        self.assertTrue(fuzzy.is_fuzzy(search_books(Book.objects.all(), "austen")))
+
+    def test_trigrams_follow_saves_and_deletes(self):
+        self.hobbit.author = "Tolkien Estate"
+        self.hobbit.save()
+        self.assertEqual(
+            set(BookTrigram.objects.filter(book=self.hobbit).values_list('trigram', flat=True)),
+            fuzzy.trigrams("The Hobbit", "Tolkien Estate", "Fantasy"),
+        )
+        self.hobbit.delete()
+        self.assertEqual(self.search("tolkein"), [])
+
+    def test_rebuild_and_bulk_imports_index_books(self):
+        BookTrigram.objects.all().delete()
+        self.assertEqual(fuzzy.rebuild_trigrams(), 3)
+        self.assertEqual(self.search("hobit"), [self.hobbit])
+        import_books(StringIO("title,author,genre,status\nDracula,Bram Stoker,Horror,available\n"))
+        self.assertEqual([book.title for book in self.search("brahm stocker")], ["Dracula"])
+
+    def test_book_list_says_when_results_are_close_matches(self):
+        response = self.client.get(reverse('book_list'), {'search': 'tolkein'})
+        self.assertEqual(list(response.context['books']), [self.hobbit])
+        self.assertContains(response, "close matches are listed after them")
+
+
+class BatchLoanTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = [Book.objects.create(title=f"Book {n}", author="Author", genre="Fiction") for n in range(6)]
+        self.student = CustomUser.objects.create_user(username="cart", password="pw", role='student')
+        self.other = CustomUser.objects.create_user(username="other", password="pw", role='student')
+        self.admin = CustomUser.objects.create_user(username="desk", password="pw", role='admin')
+        self.client.force_login(self.student)
+
+    def post(self, name, **data):
+        return self.client.post(reverse(name), data)
+
+    def test_checkout_borrows_up_to_the_limit_in_one_request(self):
+        loans.borrow(self.other, self.books[5].id)
+        ids = [book.id for book in self.books[:4]] + [self.books[5].id, 999999]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post('checkout_books', book_ids=ids)
+        body = response.json()
+        self.assertEqual(body['succeeded'], 3)
+        self.assertEqual([result['ok'] for result in body['results']], [True, True, True, False, False, False])
+        self.assertIn("maximum of 3", body['results'][3]['error'])
+        self.assertIn("already borrowed", body['results'][4]['error'])
+        self.assertIn("No Book", body['results'][5]['error'])
+        self.assertLessEqual(len(queries), 12)
+
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.active_loans, 3)
+        self.assertEqual(
+            list(Book.objects.filter(status='borrowed').order_by('id').values_list('id', flat=True)),
+            [book.id for book in self.books[:3]] + [self.books[5].id],
+        )
+        self.assertEqual(
+            sorted(BorrowedBook.objects.filter(user=self.student).values_list('id', flat=True)),
+            sorted(result['loan_id'] for result in body['results'][:3]),
+        )
+
+    def test_checkout_accepts_a_json_body_and_rejects_bad_input(self):
+        response = self.client.post(
+            reverse('checkout_books'), json.dumps({'book_ids': [self.books[0].id]}), content_type='application/json',
+        )
+        self.assertEqual(response.json()['succeeded'], 1)
+        self.assertEqual(self.post('checkout_books', book_ids=['x']).status_code, 400)
+        self.assertEqual(self.post('checkout_books').status_code, 400)
+        self.assertEqual(self.post('checkout_books', book_ids=list(range(views.MAX_BATCH_SIZE + 1))).status_code, 400)
+        self.assertEqual(self.client.get(reverse('checkout_books')).status_code, 405)
+
+    def test_return_books_closes_only_the_users_open_loans(self):
+        mine = [loans.borrow(self.student, book.id).id for book in self.books[:2]]
+        theirs = loans.borrow(self.other, self.books[2].id).id
+        loans.return_loan(self.student, mine[1])
+
+        body = self.post('return_books', loan_ids=[mine[0], mine[1], theirs]).json()
+        self.assertEqual(body['succeeded'], 1)
+        self.assertEqual([result['ok'] for result in body['results']], [True, False, False])
+        self.assertEqual(body['results'][0]['book_id'], self.books[0].id)
+        self.student.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.student.active_loans, self.other.active_loans), (0, 1))
+        self.assertEqual(Book.objects.get(id=self.books[0].id).status, 'available')
+        self.assertEqual(Book.objects.get(id=self.books[2].id).status, 'borrowed')
+
+    def test_desk_return_checks_in_books_across_borrowers(self):
+        for user, book in [(self.student, 0), (self.student, 1), (self.other, 2)]:
+            loans.borrow(user, self.books[book].id)
+        self.assertEqual(self.post('desk_return', book_ids=[self.books[0].id]).status_code, 403)
+
+        self.client.force_login(self.admin)
+        body = self.post('desk_return', book_ids=[book.id for book in self.books[:4]]).json()
+        self.assertEqual([result['ok'] for result in body['results']], [True, True, True, False])
+        self.assertIn("not on loan", body['results'][3]['error'])
+        self.student.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.student.active_loans, self.other.active_loans), (0, 0))
+        self.assertFalse(BorrowedBook.objects.open().exists())
+        self.assertFalse(Book.objects.filter(status='borrowed').exists())
@@ -0,0 +1,131 @@
+# library/throttle.py
+"""
+Login throttling, checked before the password is hashed.
+
+Every login POST takes a token from two buckets, one for the client IP
+and one for the username tried. Buckets refill continuously and live in
+the cache, so all workers share them when the cache is shared. A request
+that finds either bucket empty is rejected straight away, which costs a
+couple of cache reads instead of a PBKDF2 verification.
+
+If the cache itself fails, each process falls back to an in-memory
+sliding window with the same limits, so a cache outage does not open the
+door to credential stuffing.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+BUCKET_KEY = 'library:login_throttle:{}:{}'
+COUNTER_KEY = 'library:login_throttle:{}'
+
+# burst: attempts allowed at once; per_minute: how fast they come back
+DEFAULT_LIMITS = {
+    'ip': {'burst': 20, 'per_minute': 10},
+    'username': {'burst': 5, 'per_minute': 2},
+}
+
+
+def limits():
+    return getattr(settings, 'LIBRARY_LOGIN_THROTTLE', DEFAULT_LIMITS)
+
+
+def client_ip(request):
+    # REMOTE_ADDR only: X-Forwarded-For is client-controlled unless a proxy
+    # we trust rewrites it.
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def take_token(key, burst, per_minute, now):
+    """Take one token from the bucket at ``key``; return seconds to wait, or 0 if taken.
+
+    The read and write are not atomic, so concurrent requests may both take
+    the last token; the limits are approximate by at most the number of
+    workers, which is fine for shedding load.
+    """
+    rate = per_minute / 60
+    tokens, updated = cache.get(key) or (burst, now)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    cache.set(key, (tokens - 1, now), timeout=int(burst / rate) + 1)
+    return 0
+
+
+class SlidingWindow:
+    """Per-process fallback: at most ``burst`` attempts per burst/per_minute minutes."""
+
+    max_keys = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = OrderedDict()
+
+    def take(self, key, burst, per_minute, now):
+        period = burst * 60 / per_minute
+        with self.lock:
+            window = self.attempts.pop(key, None) or deque()
+            while window and window[0] <= now - period:
+                window.popleft()
+            if len(window) >= burst:
+                wait = window[0] + period - now
+            else:
+                window.append(now)
+                wait = 0
+            self.attempts[key] = window
+            while len(self.attempts) > self.max_keys:
+                self.attempts.popitem(last=False)
+        return wait
+
+
+fallback = SlidingWindow()
+
+
+def _count(name):
+    key = COUNTER_KEY.format(name)
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+    except Exception:
+        pass  # counters are best effort; never fail a login over them
+
+
+def _counter_values(values):
+    return {
+        'processed': values.get(COUNTER_KEY.format('processed'), 0),
+        'rejected': values.get(COUNTER_KEY.format('rejected'), 0),
+    }
+
+
+def counters():
+    """How many login attempts were processed and how many were rejected unhashed."""
+    return _counter_values(cache.get_many([COUNTER_KEY.format('processed'), COUNTER_KEY.format('rejected')]))
+
+
+async def acounters():
+    return _counter_values(await cache.aget_many([COUNTER_KEY.format('processed'), COUNTER_KEY.format('rejected')]))
+
+
+def check_login(request):
+    """Throttle one login attempt. Returns 0 to go ahead, else seconds to wait."""
+    now = time.time()
+    identities = {
+        'ip': client_ip(request),
+        'username': request.POST.get('username', '').strip().lower()[:150],
+    }
+    wait = 0
+    for scope, identity in identities.items():
+        key = BUCKET_KEY.format(scope, identity)
+        limit = limits()[scope]
+        try:
+            wait = take_token(key, limit['burst'], limit['per_minute'], now)
+        except Exception:
+            wait = fallback.take(key, limit['burst'], limit['per_minute'], now)
+        if wait:
+            break
+    _count('rejected' if wait else 'processed')
+    return wait
@@ -0,0 +1,216 @@
+# library/typeahead.py
+"""
+Title and author suggestions from an in-process prefix index.
+
+Titles and authors are normalized (lowercase, accents and punctuation
+dropped) and kept in one sorted list. A lookup bisects to the first key
+at or after the typed prefix and walks forward while keys still start
+with it, so it costs O(log n) plus the suggestions returned, with no
+database query. Titles are also filed without a leading "the"/"a"/"an".
+
+Each process loads its index lazily on first use, most-rated books first,
+and stops adding keys at ``max_keys`` so memory stays bounded. Saves and
+deletes made in this process are applied incrementally once they commit
+(library.signals). Changes that bypass signals (bulk imports) or are made
+in other processes show up at the next rebuild: once the index is older
+than ``max_age`` seconds it is rebuilt in a background thread while the
+old one keeps answering.
+"""
+
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+ARTICLES = ('the ', 'a ', 'an ')
+
+DEFAULTS = {'max_keys': 1000000, 'max_age': 900}
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_TYPEAHEAD', {})}
+
+
+def normalize(text):
+    if not text.isascii():
+        text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+def _keys(kind, text):
+    key = normalize(text)
+    if not key:
+        return []
+    if kind == 'title':
+        for article in ARTICLES:
+            if key.startswith(article):
+                return [key, key[len(article):]]
+    return [key]
+
+
+class PrefixIndex:
+    """Sorted normalized keys, each pointing at an entry [text, kind, references, key]."""
+
+    def __init__(self, max_keys=DEFAULTS['max_keys']):
+        self.max_keys = max_keys
+        self.keys = []
+        self.entries = {}
+        self.full = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add(self, kind, text, sort):
+        keys = _keys(kind, text)
+        if not keys:
+            return
+        entry = self.entries.get(keys[0])
+        if entry is not None and entry[3] == keys[0]:
+            entry[2] += 1
+            return
+        if len(self.keys) + len(keys) > self.max_keys:
+            self.full = True
+            return
+        entry = [text, kind, 1, keys[0]]
+        for key in keys:
+            taken = self.entries.get(key)
+            # An article-less alias never displaces a real title or author
+            if taken is not None and (key != keys[0] or taken[3] == key):
+                continue
+            self.entries[key] = entry
+            if taken is None:
+                if sort:
+                    bisect.insort(self.keys, key)
+                else:
+                    self.keys.append(key)
+
+    def load(self, rows):
+        """Fill an empty index from (title, author) rows, sorting once at the end."""
+        for title, author in rows:
+            self._add('title', title, sort=False)
+            self._add('author', author, sort=False)
+        self.keys.sort()
+        return self
+
+    def add(self, kind, text):
+        with self.lock:
+            self._add(kind, text, sort=True)
+
+    def remove(self, kind, text):
+        with self.lock:
+            keys = _keys(kind, text)
+            entry = self.entries.get(keys[0]) if keys else None
+            if entry is None or entry[3] != keys[0]:
+                return
+            entry[2] -= 1
+            if entry[2] > 0:
+                return
+            for key in keys:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+                    del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def lookup(self, prefix, limit=8):
+        """Up to ``limit`` {'text', 'kind'} suggestions whose key starts with ``prefix``, in key order."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        suggestions, seen = [], set()
+        with self.lock:
+            position = bisect.bisect_left(self.keys, prefix)
+            while position < len(self.keys) and len(suggestions) < limit:
+                key = self.keys[position]
+                if not key.startswith(prefix):
+                    break
+                entry = self.entries[key]
+                if id(entry) not in seen:
+                    seen.add(id(entry))
+                    suggestions.append({'text': entry[0], 'kind': entry[1]})
+                position += 1
+        return suggestions
+
+
+_lock = threading.Lock()
+_index = None
+_built_at = 0.0
+# Changes committed while a rebuild runs, replayed onto the new index. One
+# the rebuild's snapshot already saw is counted twice until the next one.
+_rebuilding = None
+
+
+def build_index(max_keys=None):
+    from .models import Book
+
+    books = Book.objects.order_by('-rating_count', 'id').values_list('title', 'author')
+    return PrefixIndex(max_keys or options()['max_keys']).load(books.iterator(chunk_size=5000))
+
+
+def _rebuild():
+    global _index, _built_at, _rebuilding
+    try:
+        index = build_index()
+        with _lock:
+            for method, kind, text in _rebuilding:
+                getattr(index, method)(kind, text)
+            _index, _built_at = index, time.monotonic()
+    except Exception:
+        # Keep serving the old index; try again after another max_age
+        logger.exception("Rebuilding the typeahead index failed")
+        _built_at = time.monotonic()
+    finally:
+        with _lock:
+            _rebuilding = None
+        connection.close()
+
+
+def get_index():
+    """This process's index: built on first use, rebuilt in the background once stale."""
+    global _index, _built_at, _rebuilding
+    with _lock:
+        if _index is None:
+            _index, _built_at = build_index(), time.monotonic()
+        elif _rebuilding is None and time.monotonic() - _built_at > options()['max_age']:
+            _rebuilding = []
+            threading.Thread(target=_rebuild, name='typeahead-rebuild', daemon=True).start()
+        return _index
+
+
+def discard_index():
+    """Drop this process's index; the next lookup builds it again."""
+    global _index
+    with _lock:
+        _index = None
+
+
+def suggest(prefix, limit=8):
+    return get_index().lookup(prefix, limit)
+
+
+def _apply(method, kind, text):
+    with _lock:
+        index = _index
+        if _rebuilding is not None:
+            _rebuilding.append((method, kind, text))
+    if index is not None:
+        getattr(index, method)(kind, text)
+
+
+def book_changed(old, new):
+    """Move a book's title and author from ``old`` to ``new`` ((title, author) or None)."""
+    for kind, before, after in zip(('title', 'author'), old or (None, None), new or (None, None)):
+        if before == after:
+            continue
+        if before is not None:
+            _apply('remove', kind, before)
+        if after is not None:
+            _apply('add', kind, after)
@@ -6,7 +6,7 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.custom_login, name='login'),
     path('manage_books/', views.manage_books, name='manage_books'),
-    path('manage_users/', views.view_users, name='view_users'),
+    path('manage_users/', views.manage_users, name='manage_users'),
     path('change_role/<int:user_id>/', views.change_role, name='change_role'),
     path('books/', views.list_books_student, name='list_books_student'),  # Student book list
     path('books/admin/', views.list_books_admin, name='list_books_admin'),  # Admin book list
@@ -22,9 +22,12 @@ urlpatterns = [
     path('student_dashboard/', views.student_dashboard, name='student_dashboard'),
     path('view_users/', views.view_users, name='view_users'),
     path('book/<int:book_id>/submit_review/', views.submit_review, name='submit_review'),
-    path('books/', views.book_list, name='book_list'),
+    path('books/search/', views.book_list, name='book_list'),
     path('books/borrow/<int:book_id>/', views.borrow_book, name='borrow_book'),
     path('books/return/<int:borrowed_book_id>/', views.return_book, name='return_book'),  # Add this line for the return_book view
+    path('books/checkout/', views.checkout_books, name='checkout_books'),  # Borrow a cart of books at once
+    path('books/return/', views.return_books, name='return_books'),  # Return several loans at once
+    path('desk/returns/', views.desk_return, name='desk_return'),  # Admins check in a stack of books
     path('books/rate/<int:borrowed_book_id>/', views.submit_rating, name='submit_rating'),  # Add this line for the submit_rating view
     path('create_admin/', views.create_admin, name='create_admin'),
     path('manage_admins/', views.manage_admins, name='manage_admins'),
@@ -33,4 +36,10 @@ urlpatterns = [
     path('delete_superadmin/<int:superadmin_id>/', views.delete_superadmin, name='delete_superadmin'),
     path('change_role/<int:user_id>/', views.change_role, name='change_role'),
     path('student/borrowed_books/', views.student_borrowed_books, name='student_borrowed_books'),  # Student borrowed books
+    path('exports/<str:kind>/', views.export_data, name='export_data'),  # CSV/JSONL exports for admins
+    path('metrics/', views.metrics_view, name='metrics'),  # Per-view request metrics for super admins
+    path('api/books/', views.api_books, name='api_books'),  # Read-only JSON catalog
+    path('api/books/search/', views.api_book_search, name='api_book_search'),
+    path('api/books/suggest/', views.api_book_suggest, name='api_book_suggest'),  # Typeahead
+    path('api/books/<int:book_id>/', views.api_book_detail, name='api_book_detail'),
 ]
\ No newline at end of file
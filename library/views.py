@@ -1,48 +1,156 @@
-from datetime import timedelta
+import json
+import math
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q
+from django.views.decorators.http import condition, require_POST
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Prefetch, Q
 from .models import CustomUser, Book, BorrowedBook, Review
 from django.contrib.auth.forms import AuthenticationForm
 from .forms import LoginForm, RatingForm, ReviewForm, AdminCreationForm, BookForm, RegisterForm, RoleChangeForm
-from .decorators import role_required
+from .decorators import read_replica, role_required
+from .facets import afacet_counts, apply_filters
+from .fuzzy import is_fuzzy
+from . import api, exports, loans, metrics, throttle, typeahead
+from .catalog_cache import acatalog_context, catalog_context
+from .pagination import paginate
+from .recommendations import recommended_for
+from .routers import pin_to_primary
+from .search import RANKED_ORDERING, asearch_books, is_ranked, search_books
+
+# Catalog listings are keyset-paginated in title order; id breaks ties.
+CATALOG_ORDERING = ('title', 'id')
+# ?sort=rating lists the best rated books first
+RATING_ORDERING = ('-rating_avg', '-id')
+# Typeahead suggestions per request: ?limit= may ask for up to the max
+SUGGEST_LIMIT = 8
+MAX_SUGGEST_LIMIT = 20
+# Books or loans one checkout, batch return or desk return may list
+MAX_BATCH_SIZE = 50
+
+
+def catalog_ordering(request):
+    if request.GET.get('sort') == 'rating':
+        return RATING_ORDERING
+    return CATALOG_ORDERING
+
+
+def filter_catalog(request):
+    """Return (queryset, ordering) for the book_list filters in ``request.GET``.
+
+    Shared by the HTML search page and the JSON API: ?search= (ranked full
+    text), ?genre=, ?author=, ?status= and ?sort=.
+    """
+    # Ranked full-text match (FTS5 on SQLite), best hits first
+    return _catalog_filters(request, search_books(Book.objects.all(), request.GET.get('search', '')))
+
+
+async def afilter_catalog(request):
+    return _catalog_filters(request, await asearch_books(Book.objects.all(), request.GET.get('search', '')))
+
+
+def _catalog_filters(request, books):
+    # genre and status are exact-match facets, author a substring
+    books = apply_filters(books, request.GET)
+
+    # Relevance order while searching, catalog order otherwise
+    ordering = RANKED_ORDERING if is_ranked(books) else catalog_ordering(request)
+    return books, ordering
+
+
+async def arender_catalog(request, page, template, context):
+    """Render a catalog page from an async view.
+
+    The page's rows are fetched with the async ORM first, even when the
+    template's ``{% cache %}`` fragment may be stored: it can expire before
+    the render. The render itself runs in a worker thread, since the tag
+    reads and writes the cache synchronously. A cached fragment still
+    saves the rendering.
+    """
+    await page.afetch()
+    return await sync_to_async(render)(request, template, context)
+
+
+def _user_admin_page(request):
+    """Render one page of users with their open loans in a constant number of queries.
+
+    Users come from one keyset-paginated query (optionally filtered by
+    ?role= and ?overdue=1) and all of the page's open loans, with their
+    books, from one prefetch query.
+    """
+    now = timezone.now()
+    users = CustomUser.objects.all()
+
+    role_filter = request.GET.get('role', '')
+    if role_filter:
+        users = users.filter(role=role_filter)
+
+    overdue_filter = request.GET.get('overdue', '')
+    if overdue_filter:
+        users = users.filter(Exists(BorrowedBook.objects.overdue(now).filter(user=OuterRef('pk'))))
+
+    open_loans = (
+        BorrowedBook.objects.open()
+        .select_related('book')
+        .annotate(overdue=ExpressionWrapper(Q(due_date__lt=now), output_field=BooleanField()))
+        .order_by('due_date')
+    )
+    users = users.prefetch_related(Prefetch('borrowedbook_set', queryset=open_loans, to_attr='open_loans'))
+    page = paginate(request, users, ('username',))
+
+    return render(request, 'view_users.html', {
+        'users': page,
+        'page': page,
+        'role_filter': role_filter,
+        'overdue_filter': overdue_filter,
+        'role_choices': CustomUser.ROLE_CHOICES,
+    })
 
 
 @login_required
 @role_required(allowed_roles=['admin', 'super_admin'])
+@read_replica
 def view_users(request):
-    users = CustomUser.objects.all()
-    return render(request, 'view_users.html', {'users': users})
+    return _user_admin_page(request)
 
 
 @login_required
 @role_required(allowed_roles=['admin', 'super_admin'])
+@read_replica
 def list_books_admin(request):
-    books = Book.objects.all()
-    return render(request, 'books/list_books_admin.html', {'books': books})
+    books = paginate(request, Book.objects.all(), catalog_ordering(request))
+    return render(request, 'books/list_books_admin.html', {'books': books, 'page': books, **catalog_context()})
 
 @login_required
 @role_required(allowed_roles=['student'])
-def list_books_student(request):
-    books = Book.objects.all()
-    return render(request, 'books/list_books_student.html', {'books': books})
+@read_replica
+async def list_books_student(request):
+    books = paginate(request, Book.objects.all(), catalog_ordering(request))
+    context = {'books': books, 'page': books, **await acatalog_context()}
+    return await arender_catalog(request, books, 'books/list_books_student.html', context)
 
 @login_required
 @role_required(allowed_roles=['student'])
 def student_borrowed_books(request):
     user = request.user
-    borrowed_books = BorrowedBook.objects.filter(user=user, returned_at__isnull=True)
+    # active_loans tells us up front whether there is anything to list
+    if user.active_loans:
+        borrowed_books = BorrowedBook.objects.filter(user=user, returned_at__isnull=True).select_related('book')
+    else:
+        borrowed_books = BorrowedBook.objects.none()
 
     if request.method == 'POST':
         form = RatingForm(request.POST)
         if form.is_valid():
             borrowed_book_id = request.POST.get('borrowed_book_id')
-            borrowed_book = get_object_or_404(BorrowedBook, id=borrowed_book_id)
+            borrowed_book = get_object_or_404(BorrowedBook, id=borrowed_book_id, user=user)
             borrowed_book.rating = form.cleaned_data['rating']
             borrowed_book.save()
             return redirect('student_borrowed_books')
@@ -51,49 +159,80 @@ def student_borrowed_books(request):
 
 @login_required
 def return_book(request, borrowed_book_id):
-    borrowed_book = get_object_or_404(BorrowedBook, id=borrowed_book_id)
-
-    # Check if the logged-in user is the one who borrowed this book
-    if borrowed_book.user != request.user:
-        return HttpResponse("You can't return a book you didn't borrow.", status=403)
+    try:
+        loans.return_loan(request.user, borrowed_book_id)
+    except loans.LoanError as error:
+        return HttpResponse(str(error), status=error.status)
+    pin_to_primary(request.user.id)
 
-    # Update the borrowed book's returned date
-    borrowed_book.returned_at = timezone.now()
-    borrowed_book.save()
+    return redirect('student_borrowed_books')  # Redirect to the student's borrowed books page
 
-    # Update the book's status to available
-    borrowed_book.book.status = 'available'
-    borrowed_book.book.save()
+def _posted_ids(request, name):
+    """The list of ids posted as ``name``: a JSON body's array, or repeated form fields."""
+    if request.content_type == 'application/json':
+        try:
+            values = json.loads(request.body).get(name, [])
+        except (ValueError, AttributeError):
+            raise ValueError("Invalid JSON body.")
+    else:
+        values = request.POST.getlist(name)
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Send a list of {name}.")
+    if len(values) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} {name} per request.")
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be integers.")
+
+
+def _batch_response(request, action, name):
+    # Shared by the checkout, batch return and desk return endpoints
+    try:
+        ids = _posted_ids(request, name)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    try:
+        results = action(ids)
+    except loans.LoanError as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+    pin_to_primary(request.user.id)
+    return JsonResponse({
+        'results': results,
+        'succeeded': sum(result['ok'] for result in results),
+    }, json_dumps_params=api.JSON_PARAMS)
 
-    return redirect('student_borrowed_books')  # Redirect to the student's borrowed books page
 
 @login_required
-def borrow_book(request, book_id):
-    user = request.user
-    book = get_object_or_404(Book, id=book_id)
+@require_POST
+def checkout_books(request):
+    """Borrow a cart of books (``book_ids``) in one transaction, with a result per book."""
+    return _batch_response(request, lambda ids: loans.borrow_many(request.user, ids), 'book_ids')
 
-    # Check if the book is already borrowed
-    if book.status == 'borrowed':
-        return HttpResponse("This book is already borrowed by someone else.", status=400)
 
-    # Check if the user has already borrowed 3 books
-    borrowed_books_count = BorrowedBook.objects.filter(user=user, returned_at__isnull=True).count()
-    if borrowed_books_count >= 3:
-        return HttpResponse("You can only borrow a maximum of 3 books at a time.", status=400)
+@login_required
+@require_POST
+def return_books(request):
+    """Return several of the user's loans (``loan_ids``) in one transaction."""
+    return _batch_response(request, lambda ids: loans.return_many(request.user, ids), 'loan_ids')
 
-    # Calculate due date (e.g., 14 days from now)
-    due_date = timezone.now() + timedelta(days=14)
 
-    # Create a BorrowedBook entry
-    BorrowedBook.objects.create(
-        user=user,
-        book=book,
-        due_date=due_date
-    )
+@login_required
+@role_required(allowed_roles=['admin', 'super_admin'])
+@require_POST
+def desk_return(request):
+    """Check in a stack of scanned books (``book_ids``), whoever borrowed them."""
+    return _batch_response(request, loans.desk_return, 'book_ids')
 
-    # Update book status to borrowed
-    book.status = 'borrowed'
-    book.save()
+
+@login_required
+def borrow_book(request, book_id):
+    # Claims the book and records the loan atomically (see library.loans)
+    try:
+        loans.borrow(request.user, book_id)
+    except loans.LoanError as error:
+        return HttpResponse(str(error), status=error.status)
+    pin_to_primary(request.user.id)
 
     return redirect('list_books_student')  # Redirect to the student book list page
 
@@ -139,13 +278,20 @@ def delete_book(request, book_id):
 
 
 @login_required
+@read_replica
 def list_books(request):
-    books = Book.objects.all()
-    return render(request, 'books/list_books.html', {'books': books})
+    books = paginate(request, Book.objects.all(), catalog_ordering(request))
+    return render(request, 'books/list_books.html', {'books': books, 'page': books})
 
 @csrf_exempt
 def custom_login(request):
     if request.method == 'POST':
+        # Shed excess attempts before LoginForm hashes the password
+        wait = throttle.check_login(request)
+        if wait:
+            response = HttpResponse("Too many login attempts. Please try again later.", status=429)
+            response['Retry-After'] = str(math.ceil(wait))
+            return response
         form = LoginForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
@@ -167,16 +313,22 @@ def custom_login(request):
 
 @login_required
 @role_required(allowed_roles=['super_admin'])
-def superadmin_dashboard(request):
-    return render(request, 'superadmin_dashboard.html')
+@read_replica
+async def superadmin_dashboard(request):
+    return render(request, 'superadmin_dashboard.html', {
+        'overdue_count': await BorrowedBook.objects.overdue().acount(),
+        'login_attempts': await throttle.acounters(),
+    })
 
 @login_required
 @role_required(allowed_roles=['admin'])
-def admin_dashboard(request):
-    return render(request, 'admin_dashboard.html')
+@read_replica
+async def admin_dashboard(request):
+    return render(request, 'admin_dashboard.html', {'overdue_count': await BorrowedBook.objects.overdue().acount()})
 
 @login_required
 @role_required(allowed_roles=['student'])
+@read_replica
 def student_dashboard(request):
     return render(request, 'student_dashboard.html')
 
@@ -270,14 +422,16 @@ def register(request):
 
 @login_required
 @role_required(allowed_roles=['admin', 'super_admin'])
+@read_replica
 def manage_books(request):
-    books = Book.objects.all()
-    return render(request, 'books/manage_books.html', {'books': books})
+    books = paginate(request, Book.objects.all(), catalog_ordering(request))
+    return render(request, 'books/manage_books.html', {'books': books, 'page': books})
 
+@login_required
 @role_required(allowed_roles=['super_admin'])
+@read_replica
 def manage_users(request):
-    users = CustomUser.objects.all()
-    return render(request, 'manage_users.html', {'users': users})
+    return _user_admin_page(request)
 
 @login_required
 @role_required(allowed_roles=['super_admin'])
@@ -302,9 +456,10 @@ def is_superadmin(user):
 
 @login_required
 @user_passes_test(lambda user: user.role == 'student')
+@read_replica
 def view_books(request):
-    books = Book.objects.all()
-    return render(request, 'view_books.html', {'books': books})
+    books = paginate(request, Book.objects.all(), catalog_ordering(request))
+    return render(request, 'books/list_books_student.html', {'books': books, 'page': books, **catalog_context()})
 
 @login_required
 def role_based_redirect(request):
@@ -341,49 +496,61 @@ def submit_review(request, book_id):
             review = form.save(commit=False)
             review.book = book
             review.user = request.user
-            review.save()
+            try:
+                with transaction.atomic():
+                    review.save()
+            except IntegrityError:
+                # Lost a race with another submission; the unique constraint kept one
+                pass
             return redirect('book_detail', book_id=book.id)
     else:
         form = ReviewForm()
 
     return render(request, 'submit_review.html', {'form': form, 'book': book})
 
-def book_list(request):
+@read_replica
+async def book_list(request):
     search_query = request.GET.get('search', '')
     genre_filter = request.GET.get('genre', '')
     author_filter = request.GET.get('author', '')
     status_filter = request.GET.get('status', '')
 
-    books = Book.objects.all()
-
-    if search_query:
-        books = books.filter(
-            Q(title__icontains=search_query) |
-            Q(author__icontains=search_query) |
-            Q(genre__icontains=search_query)
-        )
-
-    if genre_filter:
-        books = books.filter(genre__icontains=genre_filter)
+    searched = await asearch_books(Book.objects.all(), search_query)
+    books = paginate(request, *_catalog_filters(request, searched))
+    facets = await afacet_counts(searched, request.GET)
 
-    if author_filter:
-        books = books.filter(author__icontains=author_filter)
+    my_loans = []
+    user = request.user  # loaded by read_replica
+    if user.is_authenticated and user.active_loans:
+        my_loans = [
+            loan async for loan in
+            BorrowedBook.objects.filter(user=user, returned_at__isnull=True).select_related('book').aiterator()
+        ]
 
-    if status_filter:
-        books = books.filter(status__icontains=status_filter)
-
-    return render(request, 'book_list.html', {
+    return await arender_catalog(request, books, 'books/book_list.html', {
         'books': books,
+        'page': books,
         'search_query': search_query,
         'genre_filter': genre_filter,
         'author_filter': author_filter,
         'status_filter': status_filter,
+        'facets': facets,
+        'fuzzy': is_fuzzy(searched),
+        # Per-user, so rendered outside the shared cached fragment
+        'my_loans': my_loans,
+        **await acatalog_context(),
     })
 
 @login_required
-def student_dashboard(request):
-    borrowed_books = BorrowedBook.objects.filter(user=request.user)
-    return render(request, 'student_dashboard.html', {'borrowed_books': borrowed_books})
+@read_replica
+async def student_dashboard(request):
+    user = request.user  # loaded by read_replica
+    borrowed_books = [loan async for loan in BorrowedBook.objects.filter(user=user).select_related('book').aiterator()]
+    overdue_count = await BorrowedBook.objects.overdue().filter(user=user).acount() if user.active_loans else 0
+    recommendations = [book async for book in recommended_for(user)] if borrowed_books else []
+    return render(request, 'student_dashboard.html', {
+        'borrowed_books': borrowed_books, 'overdue_count': overdue_count, 'recommendations': recommendations,
+    })
 
 
 @login_required
@@ -396,4 +563,85 @@ def submit_rating(request, borrowed_book_id):
             return redirect('student_dashboard')
     else:
         form = RatingForm(instance=borrowed_book)
-    return render(request, 'submit_rating.html', {'form': form, 'borrowed_book': borrowed_book})
\ No newline at end of file
+    return render(request, 'submit_rating.html', {'form': form, 'borrowed_book': borrowed_book})
+
+
+@login_required
+@role_required(allowed_roles=['super_admin'])
+def metrics_view(request):
+    # Prometheus text format; each process reports its own requests
+    return HttpResponse(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@role_required(allowed_roles=['admin', 'super_admin'])
+@read_replica
+def export_data(request, kind):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.STREAMERS:
+        return HttpResponseBadRequest("Unknown export format.")
+    try:
+        columns, rows = exports.export_rows(
+            kind,
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            status=request.GET.get('status'),
+            genre=request.GET.get('genre'),
+            role=request.GET.get('role'),
+        )
+    except exports.ExportError as error:
+        return HttpResponseBadRequest(str(error))
+
+    # Rows are written out as they come off the database cursor
+    response = StreamingHttpResponse(exports.STREAMERS[fmt](columns, rows), content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+# Read-only JSON catalog API. Clients revalidate every time (no-cache) and
+# get a 304 with no body, computed without touching book rows, while
+# nothing changed.
+
+@read_replica
+@cache_control(no_cache=True)
+@condition(etag_func=api.catalog_etag, last_modified_func=api.catalog_last_modified)
+def api_books(request):
+    books, ordering = filter_catalog(request)
+    page = paginate(request, books.only(*api.BOOK_FIELDS), ordering)
+    return JsonResponse(api.page_payload(page), json_dumps_params=api.JSON_PARAMS)
+
+
+@read_replica
+@cache_control(no_cache=True)
+async def api_book_search(request):
+    if not request.GET.get('search', '').strip():
+        return JsonResponse({'error': "Missing ?search= query."}, status=400)
+    etag, last_modified = await api.acatalog_validators(request)
+    response = api.conditional_response(request, etag, last_modified)
+    if response is None:
+        books, ordering = await afilter_catalog(request)
+        page = paginate(request, books.only(*api.BOOK_FIELDS), ordering)
+        await page.afetch()
+        response = JsonResponse(api.page_payload(page), json_dumps_params=api.JSON_PARAMS)
+    return api.set_validators(response, etag, last_modified)
+
+
+@read_replica
+def api_book_suggest(request):
+    # Answered from this process's in-memory prefix index; no query once built
+    try:
+        limit = max(1, min(int(request.GET.get('limit', SUGGEST_LIMIT)), MAX_SUGGEST_LIMIT))
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    suggestions = typeahead.suggest(request.GET.get('q', ''), limit)
+    return JsonResponse({'suggestions': suggestions}, json_dumps_params=api.JSON_PARAMS)
+
+
+@read_replica
+@cache_control(no_cache=True)
+@condition(etag_func=api.book_etag, last_modified_func=api.book_last_modified)
+def api_book_detail(request, book_id):
+    book = Book.objects.only(*api.BOOK_FIELDS).filter(pk=book_id).first()
+    if book is None:
+        return JsonResponse({'error': "Book not found."}, status=404)
+    return JsonResponse(api.book_payload(book), json_dumps_params=api.JSON_PARAMS)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_management_system.settings')
+# No persistent database connections under ASGI (see settings.DATABASES)
+os.environ.setdefault('DJANGO_ASGI', '1')
 
 application = get_asgi_application()
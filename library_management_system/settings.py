@@ -47,12 +47,31 @@ INSTALLED_APPS = [
 # settings.py
 AUTH_USER_MODEL = 'library.CustomUser'
 
+# Serves the logged-in user from the cache instead of a query per request;
+# entries are dropped on every change to the user (library.auth).
+AUTHENTICATION_BACKENDS = ['library.auth.CachedUserBackend']
+LIBRARY_USER_CACHE_TIMEOUT = 300
+
+# Log every query slower than this many milliseconds, with its SQL and view,
+# to the 'library.slow_queries' logger. Unset (the default) turns it off.
+LIBRARY_SLOW_QUERY_MS = float(os.environ['DJANGO_SLOW_QUERY_MS']) if os.environ.get('DJANGO_SLOW_QUERY_MS') else None
+
+# Login attempts allowed before the password is even checked (library.throttle):
+# a burst, then per_minute more as the bucket refills, per client IP and per username.
+LIBRARY_LOGIN_THROTTLE = {
+    'ip': {'burst': 20, 'per_minute': 10},
+    'username': {'burst': 5, 'per_minute': 2},
+}
+
 
 
 
 MIDDLEWARE = [
+    # First, so its Server-Timing and /metrics/ latency cover the whole stack
+    'library.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # SessionMiddleware that skips saving unchanged sessions
+    'library.middleware.LowWriteSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -64,7 +83,8 @@ ROOT_URLCONF = 'library_management_system.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to library.metrics
+        'BACKEND': 'library.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'Templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -84,13 +104,69 @@ WSGI_APPLICATION = 'library_management_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# The tuned SQLite backend (WAL, busy timeout, lock retries) is described in
+# library_management_system/sqlite_backend/base.py. Connections are kept
+# open for CONN_MAX_AGE seconds instead of being reopened on every request.
+# That only works under WSGI: under ASGI every request runs its ORM calls in
+# a new thread, so a persistent connection is never reused and just stays
+# open (Django ticket #33497). asgi.py sets DJANGO_ASGI, which makes the
+# default 0 there.
+SERVING_ASGI = os.environ.get('DJANGO_ASGI') == '1'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'library_management_system.sqlite_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 0 if SERVING_ASGI else 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock at BEGIN so a transaction never fails
+            # half-way trying to upgrade a read lock.
+            'transaction_mode': 'IMMEDIATE',
+            'lock_retries': 5,
+        },
+    }
+}
+
+# Optional read replica for catalog listings, search, dashboards and exports
+# (library.routers). Set DJANGO_REPLICA_NAME to a second SQLite file and keep
+# it fresh with `manage.py sync_replica --interval 5` to try it locally.
+if os.environ.get('DJANGO_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DJANGO_REPLICA_NAME'],
+    }
+    LIBRARY_READ_REPLICA = 'replica'
+
+DATABASE_ROUTERS = ['library.routers.PrimaryReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they borrow or return.
+LIBRARY_REPLICA_PIN_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory by default; point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION at
+# e.g. django.core.cache.backends.redis.RedisCache to share it between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'library'),
     }
 }
 
+# Seconds a rendered catalog fragment may be served from the cache. Changes
+# to the catalog invalidate fragments immediately (see library.catalog_cache).
+LIBRARY_CATALOG_CACHE_TIMEOUT = 300
+
+# In-process typeahead index (library.typeahead): at most max_keys titles and
+# authors per process, rebuilt in the background once max_age seconds old.
+LIBRARY_TYPEAHEAD = {
+    'max_keys': 1000000,
+    'max_age': 900,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -112,6 +188,36 @@ AUTH_PASSWORD_VALIDATORS = [
 
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 
+# Sessions live in the database by default. DJANGO_SESSION_MODE=cached_db
+# serves session reads from the cache, and signed_cookies keeps sessions in
+# the browser with no session table at all. Both low-write modes move
+# flash messages into a cookie as well, so posting a form no longer writes
+# the session. Expired rows are purged with `manage.py purge_sessions`.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = os.environ.get('DJANGO_SESSION_MODE', 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+if SESSION_MODE != 'db':
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Catalog listings are keyset-paginated; ?page_size= may ask for up to the max.
+LIBRARY_PAGE_SIZE = 25
+LIBRARY_MAX_PAGE_SIZE = 100
+
+# Maximum number of books each role may have on loan at once (default 3).
+LIBRARY_LOAN_LIMITS = {
+    'student': 3,
+    'admin': 3,
+    'super_admin': 3,
+}
+
+# Overdue fines applied by `manage.py sweep_overdue`: per started day late, capped.
+LIBRARY_DAILY_FINE = '0.25'
+LIBRARY_MAX_FINE = '10.00'
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -0,0 +1,95 @@
+"""
+SQLite backend tuned for several web workers writing to one database file.
+
+On top of Django's stock sqlite3 backend every new connection gets:
+
+- ``journal_mode=WAL`` so readers never block the writer and vice versa,
+- ``synchronous=NORMAL`` (safe under WAL, one fsync per checkpoint rather
+  than per commit),
+- a ``busy_timeout`` so a writer waits for the lock instead of failing,
+- a larger page cache and memory-mapped reads.
+
+Statements issued outside a transaction (including ``BEGIN`` itself) that
+still hit "database is locked" after the busy timeout are retried with
+jittered exponential backoff. Statements inside a transaction are never
+retried: the whole atomic block has to be, by the caller.
+
+Configure it in ``DATABASES['default']['OPTIONS']``::
+
+    'pragmas': {'cache_size': -131072},   # merged over DEFAULT_PRAGMAS
+    'lock_retries': 5,
+    'lock_retry_delay': 0.01,             # seconds, doubled per attempt
+"""
+
+import random
+import time
+
+from django.db.backends.sqlite3 import base
+from django.db.backends.sqlite3.base import Database
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,         # milliseconds
+    'cache_size': -65536,         # negative = KiB, so 64 MiB
+    'mmap_size': 268435456,       # 256 MiB
+    'temp_store': 'MEMORY',
+}
+
+MAX_RETRY_DELAY = 1.0
+
+
+def is_lock_error(error):
+    message = str(error)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+class RetryingCursor(base.SQLiteCursorWrapper):
+    """Cursor that retries autocommit statements which fail on lock contention."""
+
+    def __init__(self, connection, retries, delay):
+        super().__init__(connection)
+        self.retries = retries
+        self.delay = delay
+
+    def _retry(self, method, *args):
+        delay = self.delay
+        for attempt in range(self.retries + 1):
+            try:
+                return method(*args)
+            except Database.OperationalError as error:
+                if attempt == self.retries or self.connection.in_transaction or not is_lock_error(error):
+                    raise
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return self._retry(super().executemany, query, param_list)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # Ours, not sqlite3.connect()'s
+        for key in ('pragmas', 'lock_retries', 'lock_retry_delay'):
+            params.pop(key, None)
+        return params
+
+    @property
+    def pragmas(self):
+        return {**DEFAULT_PRAGMAS, **self.settings_dict['OPTIONS'].get('pragmas', {})}
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        options = self.settings_dict['OPTIONS']
+        retries = options.get('lock_retries', 5)
+        delay = options.get('lock_retry_delay', 0.01)
+        return self.connection.cursor(factory=lambda conn: RetryingCursor(conn, retries, delay))